@@ -4,12 +4,20 @@ __all__ = ['gui','backend']
 __version__ = '2.8.6'
 __author__ = 'Derek Fujimoto'
 
-from bccd.backend.fits import fits
-
 logger_name = 'bccd'
 icon_path = os.path.join(os.path.dirname(__file__),'images','icon.gif')
 
-from bccd.gui.bccd import bccd
+# fits and the gui are imported on first use: the gui needs a display and 
+# sets the matplotlib backend, which breaks headless use of the backend
+def __getattr__(name):
+    if name == 'fits':
+        from bccd.backend.fits import fits
+        return fits
+    if name == 'bccd':
+        from bccd.gui.bccd import bccd
+        return bccd
+    raise AttributeError("module 'bccd' has no attribute '%s'" % name)
 
 def main():
+    from bccd.gui.bccd import bccd
     bccd()
@@ -0,0 +1,266 @@
+# Follow a beam through a time-ordered sequence of images
+# Derek Fujimoto
+# Oct 2026
+
+import time
+import numpy as np
+from bccd.backend.fits import fits
+from bccd.backend.functions import gaussian2D, gaussian2D_jac
+from bccd.backend.header import get_datetime, read_header
+
+# =========================================================================== #
+class BeamTracker(object):
+    """
+        Fit 2D gaussians to a time-ordered sequence of frames of the same
+        beam, starting each fit from the result of the last.
+
+        The beam center is predicted with an alpha-beta filter, which follows
+        a steady drift. The widths, amplitude, and rotation start from the
+        last fit. These set the region of interest, which is passed straight
+        to fits.fit2D, so a warm-started frame is not searched for the beam.
+        A frame is fit from scratch (see fits.fit_gaussian2D) if it is the
+        first, if the warm-started fit fails or hits the edge of its region of
+        interest, or if its chisquared is more than chi2_jump times the
+        running average.
+
+        Data Fields:
+
+            alpha:      float, filter gain for the position, in [0, 1]
+            beta:       float, filter gain for the velocity, in [0, 2]
+            chi2:       float, chisquared of the last fit
+            chi2_jump:  float, refit from scratch if chisquared exceeds the 
+                        running average by more than this factor
+            chi2_mean:  float, exponential moving average of chisquared
+            chi2_weight: float, weight of each new frame in chi2_mean
+            fitargs:    dict, passed to fits.fit_gaussian2D as fit_kwargs
+            kwargs:     dict, passed to fits constructor
+            nsigma:     float, size of fitting region, in standard deviations
+            par:        array, last fit parameters, or None
+            position:   array, filtered (x0, y0)
+            time:       datetime of the last frame
+            velocity:   array, filtered (vx, vy), pixels per second
+    """
+
+    # fit parameter names
+    names = ('x0', 'y0', 'sigmax', 'sigmay', 'amp', 'theta')
+
+    # ======================================================================= #
+    def __init__(self, alpha=0.8, beta=0.3, chi2_jump=3, nsigma=4,
+                 fitargs=None, **kwargs):
+        """
+            alpha:      filter gain for the position
+            beta:       filter gain for the velocity
+            chi2_jump:  refit from scratch if chisquared exceeds the running 
+                        average by more than this factor
+            nsigma:     size of fitting region, in standard deviations
+            fitargs:    dict, passed to fits.fit_gaussian2D as fit_kwargs
+            kwargs:     passed to fits constructor (ex: rescale_pixels)
+        """
+
+        self.alpha = alpha
+        self.beta = beta
+        self.chi2_jump = chi2_jump
+        self.chi2_weight = 0.2
+        self.nsigma = nsigma
+        self.fitargs = {} if fitargs is None else fitargs
+        self.kwargs = kwargs
+
+        self.reset()
+
+    # ======================================================================= #
+    def _filter(self, position, dt):
+        """
+            Update the filtered position and velocity with a new measurement
+
+            position:   measured (x0, y0)
+            dt:         seconds since the last frame
+        """
+
+        position = np.asarray(position, dtype=float)
+
+        # first measurement or after reset
+        if self.position is None:
+            self.position = position
+            self.velocity = np.zeros(2)
+            return
+
+        predicted = self.position + self.velocity*dt
+        residual = position - predicted
+
+        self.position = predicted + self.alpha*residual
+        if dt > 0:
+            self.velocity = self.velocity + self.beta*residual/dt
+
+    # ======================================================================= #
+    def _fit(self, img, p0):
+        """
+            Fit image, starting from p0 or from scratch if p0 is None
+
+            returns: (par, std), or None if the warm-started fit was rejected
+        """
+
+        try:
+            if p0 is None:
+                df = img.fit_gaussian2D(draw=False, nsigma=self.nsigma,
+                                        fit_kwargs=self.fitargs)
+            else:
+                df = self._fit_warm(img, p0)
+        except (RuntimeError, ValueError):
+            if p0 is None:
+                raise
+            return None
+
+        par = df['result'].values
+        std = df['error'].values
+
+        if p0 is None:
+            return (par, std)
+
+        # rejected: center on edge of region of interest
+        ylo, yhi, xlo, xhi = img.roi
+        edge = 1e-2
+        if not (xlo+edge < par[0] < xhi-edge and ylo+edge < par[1] < yhi-edge):
+            return None
+
+        # rejected: chisquared jump
+        if self.chi2_mean is not None and img.chi2 > self.chi2_jump*self.chi2_mean:
+            return None
+
+        return (par, std)
+
+    # ======================================================================= #
+    def _fit_warm(self, img, p0):
+        """
+            Fit image within nsigma of the predicted beam, without estimating 
+            the region of interest from the image
+
+            returns: DataFrame, same format as fits.fit_gaussian2D
+        """
+        import pandas as pd
+
+        # region of interest: standard deviations along x and y
+        x0, y0, sigmax, sigmay, amp, theta = p0
+        ct = np.cos(theta)
+        st = np.sin(theta)
+        center = (x0, y0, np.hypot(ct*sigmax, st*sigmay),
+                          np.hypot(st*sigmax, ct*sigmay))
+        ylo, yhi, xlo, xhi = roi = img.get_roi(self.nsigma, center=center)
+
+        # bounds: center within the region of interest
+        smax = max(img.data.shape)
+        lo = np.array([xlo, ylo, 0, 0, 0, -np.inf])
+        hi = np.array([xhi, yhi, smax, smax, np.inf, np.inf])
+
+        p0 = np.clip(p0, lo+1e-3, hi-1e-3)
+        par, cov = img.fit2D(gaussian2D, jac=gaussian2D_jac, p0=p0, roi=roi,
+                             bounds=[lo, hi], **self.fitargs)
+
+        df = pd.DataFrame({'result': par, 'error': np.diag(cov)**0.5},
+                          index=self.names)
+        img.result_gaussian2D = df
+        return df
+
+    # ======================================================================= #
+    def predict(self, dt):
+        """
+            Get starting parameters for the next frame
+
+            dt:         seconds since the last frame
+            returns:    (x0, y0, sigmax, sigmay, amp, theta) or None if there
+                        is no previous frame
+        """
+
+        if self.par is None:
+            return None
+
+        p0 = np.array(self.par)
+        p0[:2] = self.position + self.velocity*dt
+        return p0
+
+    # ======================================================================= #
+    def reset(self):
+        """Forget the previous frames"""
+        self.chi2 = None
+        self.chi2_mean = None
+        self.par = None
+        self.position = None
+        self.time = None
+        self.velocity = np.zeros(2)
+
+    # ======================================================================= #
+    def track(self, filenames):
+        """
+            Fit a sequence of files, in order of DATE-OBS
+
+            filenames:  list of paths to .fits files
+            returns:    pandas DataFrame, one row per file (see update)
+        """
+        import pandas as pd
+
+        # sort by the time the image was taken
+        times = [get_datetime(read_header(f)) for f in filenames]
+        order = sorted(range(len(filenames)), key=lambda i: times[i])
+
+        records = [self.update(fits(filenames[i], **self.kwargs)) for i in order]
+        return pd.DataFrame(records)
+
+    # ======================================================================= #
+    def update(self, img):
+        """
+            Fit the next frame in the sequence
+
+            img:        fits object, taken after the previous frame
+            returns:    dict with the fit results and errors, chi2, nfev,
+                        warm (True if started from the previous frame) and
+                        seconds (time to fit)
+        """
+
+        start = time.perf_counter()
+
+        # time since last frame
+        if self.time is None:
+            dt = 0
+        else:
+            dt = (img.datetime - self.time).total_seconds()
+
+        # warm start, else fit from scratch
+        p0 = self.predict(dt)
+        result = None
+        nfev = 0
+
+        if p0 is not None:
+            result = self._fit(img, p0)
+            nfev = img.nfev
+
+        warm = result is not None
+
+        if not warm:
+            result = self._fit(img, None)
+            nfev += img.nfev
+            self.position = None
+
+        par, std = result
+
+        # update state
+        self._filter(par[:2], dt)
+        self.par = par
+        self.chi2 = img.chi2
+        self.time = img.datetime
+        
+        if self.chi2_mean is None:
+            self.chi2_mean = self.chi2
+        else:
+            self.chi2_mean += self.chi2_weight*(self.chi2-self.chi2_mean)
+
+        # output
+        record = {'filename':   img.filename,
+                  'datetime':   img.datetime.isoformat()}
+        for n, p, s in zip(self.names, par, std):
+            record[n] = float(p)
+            record[n+'_err'] = float(s)
+        record['chi2'] = float(img.chi2)
+        record['nfev'] = int(nfev)
+        record['warm'] = warm
+        record['seconds'] = time.perf_counter()-start
+
+        return record
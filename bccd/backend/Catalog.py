@@ -0,0 +1,313 @@
+# Header-indexed catalog of the local image archive
+# Derek Fujimoto
+# Oct 2026
+
+import os
+import json
+import sqlite3
+from dateutil import tz
+from bccd.backend.header import read_header
+
+# =========================================================================== #
+class Catalog(object):
+    """
+        Persistent SQLite index of all .fits files in a directory tree, with
+        the header values needed to search them.
+
+        The catalog is updated incrementally: every directory is stat-ed, but
+        only those whose modification time changed since the last update are
+        listed, the subdirectories of the others are taken from the catalog.
+        Only new or changed files have their headers read. Files rewritten in
+        place (ex: by rsync --inplace) don't change their directory's
+        modification time, so the indexed files in the directories with the
+        most recently modified images are always checked.
+
+        Data Fields:
+
+            connection: sqlite3 connection to the database
+            path:       str, database filename
+            root:       str, top directory of the image archive
+    """
+
+    # header keywords to index: (column name, header keyword)
+    columns = (('date_obs', 'DATE-OBS'),
+               ('exposure', 'EXPOSURE'),
+               ('bzero',    'BZERO'),
+               ('xpixsz',   'XPIXSZ'),
+               ('ypixsz',   'YPIXSZ'))
+
+    # file extensions to index
+    extensions = ('.fits', '.fit', '.fts')
+
+    # number of directories with the newest images to check file by file
+    nrecent_dirs = 2
+
+    # ======================================================================= #
+    def __init__(self, root, path=None):
+        """
+            root:   top directory of the image archive
+            path:   database filename. If None, store in root/.catalog.sqlite
+        """
+
+        self.root = os.path.abspath(root)
+
+        if path is None:
+            path = os.path.join(self.root, '.catalog.sqlite')
+        self.path = path
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.connection = sqlite3.connect(path)
+
+        with self.connection as con:
+            con.execute('CREATE TABLE IF NOT EXISTS images ('
+                        'path TEXT PRIMARY KEY, '
+                        'dir TEXT, '
+                        'mtime INTEGER, '
+                        'size INTEGER, '
+                        'date_obs TEXT, '
+                        'exposure REAL, '
+                        'bzero REAL, '
+                        'xpixsz REAL, '
+                        'ypixsz REAL)')
+            con.execute('CREATE TABLE IF NOT EXISTS dirs ('
+                        'path TEXT PRIMARY KEY, '
+                        'mtime INTEGER, '
+                        'children TEXT)')
+
+            # catalogs made before subdirectories were stored
+            names = [row[1] for row in con.execute('PRAGMA table_info(dirs)')]
+            if 'children' not in names:
+                con.execute('ALTER TABLE dirs ADD COLUMN children TEXT')
+            con.execute('CREATE INDEX IF NOT EXISTS idx_mtime ON images (mtime)')
+            con.execute('CREATE INDEX IF NOT EXISTS idx_date ON images (date_obs)')
+            con.execute('CREATE INDEX IF NOT EXISTS idx_exposure ON images (exposure)')
+            con.execute('CREATE INDEX IF NOT EXISTS idx_dir ON images (dir)')
+
+    # ======================================================================= #
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM images').fetchone()[0]
+
+    # ======================================================================= #
+    def _read_header(self, filename):
+        """
+            Get the indexed header values from a file
+
+            returns: list of values in the order of self.columns
+        """
+        try:
+            header = read_header(filename)
+        except Exception:
+            return [None]*len(self.columns)
+
+        return [header.get(key, None) for _, key in self.columns]
+
+    # ======================================================================= #
+    def _to_utc(self, date):
+        """
+            Convert datetime to string matching DATE-OBS
+
+            Naive datetimes are assumed to be in the local time zone
+        """
+
+        if isinstance(date, str):
+            return date
+
+        date = date.astimezone(tz.tzutc())
+        return date.strftime('%Y-%m-%dT%H:%M:%S')
+
+    # ======================================================================= #
+    def add(self, filenames):
+        """
+            Add or update specific files in the catalog, without scanning
+            directories
+
+            filenames:  list of paths to image files
+            returns:    list of paths which were added or changed
+        """
+
+        changed = []
+        rows = []
+
+        for filename in filenames:
+            filename = os.path.abspath(filename)
+
+            try:
+                stat = os.stat(filename)
+            except FileNotFoundError:
+                self.remove([filename])
+                continue
+
+            # check if the file is already indexed
+            old = self.connection.execute('SELECT mtime, size FROM images WHERE path=?',
+                                          (filename,)).fetchone()
+            if old == (stat.st_mtime_ns, stat.st_size):
+                continue
+
+            rows.append((filename, os.path.dirname(filename), stat.st_mtime_ns,
+                         stat.st_size, *self._read_header(filename)))
+            changed.append(filename)
+
+        with self.connection as con:
+            con.executemany('INSERT OR REPLACE INTO images VALUES (?,?,?,?,?,?,?,?,?)',
+                            rows)
+
+        return changed
+
+    # ======================================================================= #
+    def latest(self):
+        """
+            Get the last modified image file
+
+            returns: path or None if the catalog is empty
+        """
+        recent = self.recent(1)
+        if not recent:
+            return None
+        return recent[0]
+
+    # ======================================================================= #
+    def query(self, start=None, stop=None, exposure=None, limit=None):
+        """
+            Find images, ordered by DATE-OBS
+
+            start:      datetime or DATE-OBS string, earliest image time
+            stop:       datetime or DATE-OBS string, latest image time
+            exposure:   float or (lo, hi) tuple, exposure time in seconds.
+                        Either bound may be None.
+            limit:      int, maximum number of files to return
+
+            returns:    list of paths
+        """
+
+        conditions = []
+        values = []
+
+        if start is not None:
+            conditions.append('date_obs >= ?')
+            values.append(self._to_utc(start))
+
+        if stop is not None:
+            conditions.append('date_obs <= ?')
+            values.append(self._to_utc(stop))
+
+        if exposure is not None:
+            if not isinstance(exposure, (tuple, list)):
+                exposure = (exposure, exposure)
+
+            if exposure[0] is not None:
+                conditions.append('exposure >= ?')
+                values.append(exposure[0])
+            if exposure[1] is not None:
+                conditions.append('exposure <= ?')
+                values.append(exposure[1])
+
+        cmd = 'SELECT path FROM images'
+        if conditions:
+            cmd += ' WHERE ' + ' AND '.join(conditions)
+        cmd += ' ORDER BY date_obs'
+
+        if limit is not None:
+            cmd += ' LIMIT %d' % limit
+
+        return [row[0] for row in self.connection.execute(cmd, values)]
+
+    # ======================================================================= #
+    def recent(self, n):
+        """
+            Get the last modified image files
+
+            n:          maximum number of files
+            returns:    list of paths, newest first
+        """
+        return [row[0] for row in 
+                self.connection.execute('SELECT path FROM images '
+                                        'ORDER BY mtime DESC LIMIT ?', (n, ))]
+
+    # ======================================================================= #
+    def remove(self, filenames):
+        """
+            Remove files from the catalog
+
+            filenames:  list of paths to image files
+        """
+        with self.connection as con:
+            con.executemany('DELETE FROM images WHERE path=?',
+                            [(os.path.abspath(f),) for f in filenames])
+
+    # ======================================================================= #
+    def update(self, full=False):
+        """
+            Scan the archive for new, changed, or removed files
+
+            full:       if True, check every file, not only those in directories
+                        which have been modified or hold the newest images. Use
+                        to detect older files which were rewritten in place.
+            returns:    list of paths which were added or changed
+        """
+
+        changed = []
+        stored = {row[0]: (row[1], row[2]) for row in
+                  self.connection.execute('SELECT path, mtime, children FROM dirs')}
+
+        # files here may be rewritten in place
+        recent = {row[0] for row in
+                  self.connection.execute('SELECT dir FROM images GROUP BY dir '
+                                          'ORDER BY MAX(mtime) DESC LIMIT ?',
+                                          (self.nrecent_dirs, ))}
+        dirs = []
+        stack = [self.root]
+
+        while stack:
+            dirpath = stack.pop()
+
+            try:
+                mtime = os.stat(dirpath).st_mtime_ns
+            except (FileNotFoundError, NotADirectoryError, PermissionError):
+                continue
+
+            old_mtime, children = stored.pop(dirpath, (None, None))
+
+            # unchanged directory contents: walk the stored subdirectories
+            if not full and old_mtime == mtime and children is not None:
+                children = json.loads(children)
+                stack.extend(os.path.join(dirpath, name) for name in children)
+                dirs.append((dirpath, mtime, json.dumps(children)))
+
+                # check the indexed files for changes in place
+                if dirpath in recent:
+                    indexed = self.connection.execute('SELECT path FROM images '
+                                                      'WHERE dir=?',
+                                                      (dirpath,)).fetchall()
+                    changed.extend(self.add([row[0] for row in indexed]))
+                continue
+
+            try:
+                entries = list(os.scandir(dirpath))
+            except (FileNotFoundError, NotADirectoryError, PermissionError):
+                continue
+
+            # skip hidden directories (ex: caches)
+            children = sorted(e.name for e in entries
+                              if e.is_dir() and not e.name.startswith('.'))
+            stack.extend(os.path.join(dirpath, name) for name in children)
+            dirs.append((dirpath, mtime, json.dumps(children)))
+
+            # find image files
+            filenames = [e.path for e in entries if e.is_file() and
+                         os.path.splitext(e.name)[1].lower() in self.extensions]
+            changed.extend(self.add(filenames))
+
+            # remove deleted files
+            indexed = self.connection.execute('SELECT path FROM images WHERE dir=?',
+                                              (dirpath,)).fetchall()
+            filenames = set(filenames)
+            self.remove([row[0] for row in indexed if row[0] not in filenames])
+
+        # remove deleted directories
+        with self.connection as con:
+            for dirpath in stored.keys():
+                con.execute('DELETE FROM images WHERE dir=?', (dirpath,))
+            con.execute('DELETE FROM dirs')
+            con.executemany('INSERT INTO dirs VALUES (?,?,?)', dirs)
+
+        return changed
@@ -0,0 +1,169 @@
+# Load images in the background, and prefetch images before they are opened
+# Derek Fujimoto
+# Oct 2026
+
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from bccd.backend.fits import fits
+from bccd.backend.ResultsStore import ResultsStore
+
+# =========================================================================== #
+class ImageLoader(object):
+    """
+        Read and rescale fits images in a pool of threads, so that the caller
+        (ex: the gui) isn't blocked. Images which are likely to be opened next
+        can be prefetched.
+
+        Each image returned by load belongs to the caller: prefetched images
+        are removed from the loader when they are used. Prefetched images are
+        keyed by file size and modification time, so that files which change
+        are loaded again.
+
+        Stored analysis results can also be found in the background, since
+        the file may need to be hashed (see ResultsStore).
+
+        Data Fields:
+
+            executor:   ThreadPoolExecutor
+            hits:       int, number of loads which were prefetched
+            misses:     int, number of loads which were not prefetched
+            nbytes:     int, bytes of pixel arrays held by prefetched images
+            nprefetch:  int, maximum number of prefetched images to keep
+            prefetched: OrderedDict, {key: Future}, oldest first
+            results:    str, path of ResultsStore database, or None for the
+                        default
+    """
+
+    # ======================================================================= #
+    def __init__(self, nthreads=2, nprefetch=3, results=None):
+        """
+            nthreads:   number of images to load at the same time
+            nprefetch:  maximum number of prefetched images to keep
+            results:    path of ResultsStore database for find
+        """
+        self.executor = ThreadPoolExecutor(max_workers=nthreads,
+                                           thread_name_prefix='bccd-loader')
+        self.nprefetch = nprefetch
+        self.prefetched = OrderedDict()
+        self.results = results
+        self.hits = 0
+        self.misses = 0
+
+        # sqlite connections can't be shared between threads
+        self._local = threading.local()
+
+    # ======================================================================= #
+    @property
+    def nbytes(self):
+        """Bytes of pixel arrays held by prefetched images"""
+        return sum(f.result().nbytes for f in tuple(self.prefetched.values())
+                   if f.done() and not f.cancelled() and f.exception() is None)
+
+    # ======================================================================= #
+    def _find(self, filename, version):
+        """
+            Find stored results, hashing the file if needed
+
+            returns: (params, record) or None if not found
+        """
+        store = getattr(self._local, 'store', None)
+        if store is None:
+            store = self._local.store = ResultsStore(self.results)
+        return store.find(filename, version)
+
+    # ======================================================================= #
+    def _key(self, filename, kwargs):
+        """
+            Get key for a file and fits options
+
+            returns: tuple, or None if the file doesn't exist
+        """
+        filename = os.path.abspath(filename)
+
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return None
+
+        return (filename, stat.st_size, stat.st_mtime_ns,
+                tuple(sorted(kwargs.items())))
+
+    # ======================================================================= #
+    def _load(self, filename, kwargs):
+        """
+            Read the image and its pixels
+
+            returns: fits object
+        """
+        img = fits(filename, **kwargs)
+        img.data_original
+        return img
+
+    # ======================================================================= #
+    def find(self, filename, version=None):
+        """
+            Start finding stored analysis results for a file
+
+            filename:   path to image file
+            version:    analysis version. If None, any version
+
+            returns: Future whose result is (params, record) or None, see
+                     ResultsStore.find
+        """
+        return self.executor.submit(self._find, filename, version)
+
+    # ======================================================================= #
+    def load(self, filename, **kwargs):
+        """
+            Start loading an image, or get it if it was prefetched
+
+            filename:   path to .fits file
+            kwargs:     passed to fits constructor (ex: rescale_pixels)
+
+            returns: Future whose result is the fits object
+        """
+
+        future = self.prefetched.pop(self._key(filename, kwargs), None)
+
+        # prefetched, and not failed
+        if future is not None and not future.cancelled() and \
+           not (future.done() and future.exception() is not None):
+            self.hits += 1
+            return future
+
+        self.misses += 1
+        return self.executor.submit(self._load, filename, kwargs)
+
+    # ======================================================================= #
+    def prefetch(self, filenames, **kwargs):
+        """
+            Start loading images which may be opened soon. Only the last
+            nprefetch images are kept.
+
+            filenames:  list of paths to .fits files, most likely first
+            kwargs:     passed to fits constructor (ex: rescale_pixels)
+        """
+
+        for filename in reversed(filenames[:self.nprefetch]):
+            key = self._key(filename, kwargs)
+            if key is None:
+                continue
+
+            if key in self.prefetched:
+                self.prefetched.move_to_end(key)
+            else:
+                self.prefetched[key] = self.executor.submit(self._load,
+                                                            filename, kwargs)
+
+        # forget the oldest
+        while len(self.prefetched) > self.nprefetch:
+            _, future = self.prefetched.popitem(last=False)
+            future.cancel()
+
+    # ======================================================================= #
+    def shutdown(self):
+        """Stop loading images"""
+        self.prefetched.clear()
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,101 @@
+# Process-wide store of pixel arrays shared by fits objects of the same file
+# Derek Fujimoto
+# Oct 2026
+
+import os
+import threading
+import weakref
+
+# =========================================================================== #
+class ImageStore(object):
+    """
+        Store of read-only pixel arrays, so that fits objects of the same file
+        and rescale settings (ex: the same image open in two tabs) share one
+        copy of the pixels. Each fits object keeps its own black, white and
+        mask settings, and copies the pixels only if they must change (ex:
+        clipping to black and white).
+
+        Entries are keyed by file path, size, modification time and settings,
+        so a file which changes on disk is never served stale. Arrays are held
+        by weak reference: each is freed when no fits object uses it.
+
+        Data Fields:
+
+            hits:       int, number of arrays found in the store
+            misses:     int, number of arrays not found in the store
+    """
+
+    # ======================================================================= #
+    def __init__(self):
+        self._arrays = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    # ======================================================================= #
+    def __len__(self):
+        return len(self._arrays)
+
+    # ======================================================================= #
+    def get(self, key):
+        """
+            Fetch array from the store
+
+            key:        tuple, as generated by self.key
+            returns:    read-only array, or None if not found
+        """
+        with self._lock:
+            data = self._arrays.get(key, None)
+
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        return data
+
+    # ======================================================================= #
+    def key(self, filename, *settings):
+        """
+            Make store key for a file
+
+            filename:   path to the image file
+            settings:   other values which change the pixels (ex: rescale
+                        factors)
+            returns:    tuple
+        """
+        filename = os.path.abspath(filename)
+        stat = os.stat(filename)
+        return (filename, stat.st_size, stat.st_mtime_ns, settings)
+
+    # ======================================================================= #
+    def put(self, key, data):
+        """
+            Save array to the store, unless another thread saved it first
+
+            key:        tuple, as generated by self.key
+            data:       numpy array, set to read-only
+            returns:    the stored array, which should be used in place of data
+        """
+
+        data.flags.writeable = False
+
+        with self._lock:
+            return self._arrays.setdefault(key, data)
+
+    # ======================================================================= #
+    def stats(self):
+        """
+            Get store statistics
+
+            returns: dict with keys hits, misses, narrays, nbytes. Memory-mapped
+                     arrays (ex: from the rescale cache) are not counted in
+                     nbytes.
+        """
+        with self._lock:
+            arrays = list(self._arrays.values())
+
+        return {'hits':     self.hits,
+                'misses':   self.misses,
+                'narrays':  len(arrays),
+                'nbytes':   sum(a.nbytes for a in arrays if a.base is None)}
@@ -4,14 +4,18 @@
 
 import matplotlib as mpl
 import matplotlib.pyplot as plt
+from contextlib import contextmanager
 import yaml
 import os
-from bccd.backend.Target import Circle, Square, Rectangle, Ellipse
 
 # =========================================================================== #
 class PltTracker(object):
     """
         active:         dictionary, id number of active plot
+        last_action:    dict, {'ndraws': canvas draws, 'nlayouts': tight
+                        layouts} since the start of the last transaction
+        ndraws:         int, number of canvas draws of all figures
+        nlayouts:       int, number of tight layouts of all figures
         plots:          dictionary, list of plots drawn for type
     """
 
@@ -27,6 +31,17 @@ class PltTracker(object):
         # track parent
         self.bccd = bccd
 
+        # transactions: figures to lay out and redraw at the end
+        self._depth = 0
+        self._callbacks = {}
+        self._dirty = set()
+        self._layout = {}
+
+        # count draws, for each action
+        self.ndraws = 0
+        self.nlayouts = 0
+        self.last_action = {'ndraws':0, 'nlayouts':0}
+
     # ======================================================================= #
     def _close_figure(self, event):
         """Remove figure from list"""
@@ -37,6 +52,7 @@ class PltTracker(object):
         # disconnect events
         event.canvas.mpl_disconnect(event.canvas.user_close)
         event.canvas.mpl_disconnect(event.canvas.user_active)
+        event.canvas.mpl_disconnect(event.canvas.user_draw)
 
         # close the winow
         plt.figure(number).clf()
@@ -52,6 +68,12 @@ class PltTracker(object):
         except IndexError:
             self.active = 0
 
+    # ======================================================================= #
+    def _count_draw(self, event):
+        """Count canvas draws"""
+        self.ndraws += 1
+        self.last_action['ndraws'] += 1
+
     # ======================================================================= #
     def _decorator(self, fn, *args, id=None, unique=True, **kwargs):
         """
@@ -79,54 +101,144 @@ class PltTracker(object):
 
         return output
 
+    # ======================================================================= #
+    def _draw_idle(self, fig):
+        """Redraw figure when idle, or at the end of the transaction"""
+        if self._depth > 0:
+            self._dirty.add(fig)
+        else:
+            fig.canvas.draw_idle()
+
+    # ======================================================================= #
+    def _flush(self):
+        """
+            End of transaction: lay out and redraw the figures which changed
+        """
+
+        callbacks, self._callbacks = self._callbacks, {}
+        dirty, self._dirty = self._dirty, set()
+        layout, self._layout = self._layout, {}
+
+        figures = self._get_figures()
+
+        # lay out before redrawing after each change again
+        for fig in figures:
+            if fig in layout:
+                self._tight_layout(fig, *layout[fig][0], **layout[fig][1])
+
+        for fig, callback in callbacks.items():
+            fig.stale_callback = callback
+
+        for fig in figures:
+            if fig in dirty or fig.stale:
+                fig.canvas.draw_idle()
+
+    # ======================================================================= #
+    def _get_figures(self):
+        """Get the open figures, without changing the active figure"""
+        
+        numbers = [n for n in self.plots if plt.fignum_exists(n)]
+        if not numbers:
+            return []
+        
+        current = plt.gcf().number
+        figures = [plt.figure(n) for n in numbers]
+        plt.figure(current)
+        return figures
+
+    # ======================================================================= #
+    def _get_layout_key(self, fig):
+        """
+            Get the figure size and the axis text and limits, which set the
+            tight layout
+        """
+        return (tuple(fig.get_size_inches()), fig.dpi,
+                tuple((ax.get_title(), ax.get_xlabel(), ax.get_ylabel(),
+                       ax.get_xlim(), ax.get_ylim()) for ax in fig.axes))
+
     # ======================================================================= #
     def _remove_drawn_object(self, ax, draw_id):
         """
-            Remove an object labelled by draw_id from the figure, based on draw
-            style.
+            Remove an object labelled by draw_id from the figure. The figure 
+            is redrawn when idle. 
         """
 
-        # check if id is present in drawn data
-        if draw_id in ax.draw_objs.keys():
+        if draw_id not in ax.draw_objs.keys():
+            return
 
-            # get item
-            for item in ax.draw_objs[draw_id]:
+        for item in ax.draw_objs.pop(draw_id):
 
-                # strip saveas dict
+            # strip saveas dict
+            if isinstance(item, tuple) and len(item) == 2 and isinstance(item[1], dict):
                 item = item[0]
 
-                # remove line
-                try:
-                    item[0].remove()
-                except TypeError:
+            # errorbars: remove the lines and the container
+            if isinstance(item, mpl.container.Container):
+                item.remove()
+                continue
+
+            # lists of lines from plot
+            if not isinstance(item, (list, tuple)):
+                item = [item]
+
+            for obj in item:
+
+                # contours before matplotlib 3.8 are not artists
+                if isinstance(obj, mpl.contour.ContourSet) and \
+                   not isinstance(obj, mpl.artist.Artist):
+                    obj = obj.collections
+
+                for artist in (obj if isinstance(obj, list) else [obj]):
                     try:
-                        item.remove()
-                    except AttributeError:
+                        artist.remove()
+                    except (AttributeError, NotImplementedError, ValueError):
                         pass
-                else:
-                    # remove errorbars
-                    if type(item) is mpl.container.ErrorbarContainer:
-                        for i in item[1]:   i.remove()
-                        for i in item[2]:   i.remove()
-                        del ax.containers[ax.containers.index(item)]
 
-                    # remove lines
-                    elif type(item) is mpl.lines.Line2D:
-                        del ax.lines[ax.lines.index(item)]
+        self._draw_idle(ax.figure)
+
+    # ======================================================================= #
+    def _suspend(self, fig):
+        """Don't redraw the figure after each change until the transaction ends"""
+        if fig not in self._callbacks:
+            self._callbacks[fig] = fig.stale_callback
+            fig.stale_callback = None
+
+    # ======================================================================= #
+    def _tight_layout(self, fig, *args, **kwargs):
+        """Fit the axes to the figure, if the axis text, limits or size changed"""
+
+        key = self._get_layout_key(fig)
+        if getattr(fig, 'layout_key', None) == key:
+            return
+
+        fig.tight_layout(*args, **kwargs)
+        fig.layout_key = key
+        self.nlayouts += 1
+        self.last_action['nlayouts'] += 1
+
+    # ======================================================================= #
+    def _update_image(self, obj, X, cmap, alpha, vmin, vmax, interpolation):
+        """
+            Update a drawn image in place, and redraw when idle
+
+            obj: AxesImage
+            X: image data, only set if not already drawn
+        """
 
-                    # remove images
-                    elif type(item) is mpl.image.AxesImage:
-                        del ax.image[ax.image.index(item)]
+        if getattr(obj, 'source', None) is not X:
+            obj.set_data(X)
+            obj.source = X
 
-                if type(item) is mpl.contour.QuadContourSet:
-                    for coll in item.collections:
-                        if coll in ax.collections:
-                            del ax.collections[ax.collections.index(coll)]
+        obj.set_cmap(cmap)
+        obj.set_alpha(alpha)
+        obj.set_interpolation(interpolation)
 
-            plt.draw()
+        # levels from the data if not given
+        if vmin is None or vmax is None:
+            obj.autoscale()
+        obj.set_clim(vmin, vmax)
 
-            # clear labels
-            del ax.draw_objs[draw_id]
+        self._draw_idle(obj.axes.figure)
 
     # ======================================================================= #
     def _update_active_id(self, event):
@@ -175,14 +287,36 @@ class PltTracker(object):
         fig = plt.figure(active_style)
         ax = fig.axes[0]
 
+        # check input
+        if info is None: info = {}
+
+        # same contours already drawn: only update the colours in place
+        if unique and id in ax.draw_objs:
+            obj, saveas = ax.draw_objs[id][-1]
+            options = {k:v for k, v in kwargs.items() if k not in ('cmap', 'alpha')}
+
+            if len(ax.draw_objs[id]) == 1 and \
+               isinstance(obj, mpl.contour.ContourSet) and \
+               isinstance(obj, mpl.artist.Artist) and \
+               getattr(obj, 'source', None) is Z and \
+               saveas['levels'] == levels and \
+               all(saveas.get(k) == v for k, v in options.items()):
+
+                obj.set_cmap(kwargs.get('cmap', None))
+                obj.set_alpha(kwargs.get('alpha', None))
+                self._draw_idle(fig)
+
+                saveas.update({**info, **kwargs})
+                return obj
+
         # redraw old objects and lines
         if unique:  self._remove_drawn_object(ax, id)
         self._remove_drawn_object(ax, 'line')
 
         obj = ax.contour(X, Y, Z, levels, **kwargs)
 
-        # check input
-        if info is None: info = {}
+        # keep track of the drawn data, to allow in-place updates
+        obj.source = Z
 
         saveas = {'id'              :id,
                   'levels'          :levels,
@@ -277,6 +411,11 @@ class PltTracker(object):
         # make events and save as canvas attribute
         fig.canvas.user_close = fig.canvas.mpl_connect('close_event', self._close_figure)
         fig.canvas.user_active = fig.canvas.mpl_connect('button_press_event', self._update_active_id)
+        fig.canvas.user_draw = fig.canvas.mpl_connect('draw_event', self._count_draw)
+
+        # new figure in a transaction
+        if self._depth > 0:
+            self._suspend(fig)
 
         # set window name
         fig.canvas.manager.set_window_title('Figure %d' % (fig.number))
@@ -310,10 +449,13 @@ class PltTracker(object):
     def imshow(self, id, X, cmap=None, norm=None, aspect=None, interpolation=None,
                 alpha=None, vmin=None, vmax=None, origin=None, extent=None,
                 filternorm=1, filterrad=4.0, resample=None, url=None, data=None,
-                unique=True, info=None, **kwargs):
+                unique=True, info=None, replace=None, **kwargs):
         """
-            unique: force only one of this id in the figure
+            unique: force only one of this id in the figure. If already drawn 
+                    with the same shape, the image is updated in place
             info: dict of other info to pass to plttracker, save for writing later
+            replace: id of a drawn image to replace. If it has the same shape, 
+                     its data is updated in place. 
         """
 
 
@@ -327,6 +469,54 @@ class PltTracker(object):
         fig = plt.figure(active_style)
         ax = fig.axes[0]
 
+        # check input
+        if info is None: info = {}
+
+        # already drawn: update the image in place
+        if unique and id in ax.draw_objs:
+            obj = ax.draw_objs[id][-1][0]
+
+            if len(ax.draw_objs[id]) == 1 and \
+               isinstance(obj, mpl.image.AxesImage) and \
+               obj.get_array().shape == X.shape and \
+               norm is None and extent is None and \
+               obj.origin == (origin or mpl.rcParams['image.origin']):
+
+                self._update_image(obj, X, cmap, alpha, vmin, vmax,
+                                   interpolation)
+
+                # superimposed: move to the top without making a new image
+                if ax.images[-1] is not obj:
+                    obj.remove()
+                    ax.add_image(obj)
+
+                saveas = ax.draw_objs[id][-1][1]
+                saveas.update({'cmap':cmap, 'alpha':alpha, 'vmin':vmin, 'vmax':vmax,
+                               'interpolation':interpolation, **info, **kwargs})
+                return obj
+
+        # replace another image: update the data in place
+        if replace is not None and replace != id and replace in ax.draw_objs:
+            obj = ax.draw_objs[replace][-1][0]
+
+            if id not in ax.draw_objs and \
+               len(ax.draw_objs[replace]) == 1 and \
+               isinstance(obj, mpl.image.AxesImage) and \
+               obj.get_array().shape == X.shape and \
+               norm is None and extent is None:
+
+                self._update_image(obj, X, cmap, alpha, vmin, vmax,
+                                   interpolation)
+
+                saveas = ax.draw_objs.pop(replace)[-1][1]
+                saveas.update({'id':id, 'cmap':cmap, 'alpha':alpha, 'vmin':vmin,
+                               'vmax':vmax, 'interpolation':interpolation,
+                               **info, **kwargs})
+                ax.draw_objs[id] = [(obj, saveas)]
+                return obj
+
+            self._remove_drawn_object(ax, replace)
+
         # redraw old objects and lines
         if unique:  self._remove_drawn_object(ax, id)
 
@@ -343,8 +533,8 @@ class PltTracker(object):
                 filterrad=filterrad, resample=resample, url=url, data=data,
                 **kwargs)
 
-        # check input
-        if info is None: info = {}
+        # keep track of the drawn data, to allow in-place updates
+        obj.source = X
 
         # save the drawn object to the file
         saveas = {'id'              :id,
@@ -404,6 +594,10 @@ class PltTracker(object):
     # ======================================================================= #
     def savefig_new(self, filename, **kwargs):
         """Save figure, alongside yaml file with figure details"""
+        
+        # targets need tkinter: only import when saving from the gui
+        from bccd.backend.Target import Circle, Square, Rectangle, Ellipse
+        
         fig = self.gcf()
 
         # get paramters for drawn objs
@@ -474,7 +668,41 @@ class PltTracker(object):
 
     # ======================================================================= #
     def tight_layout(self, *args, **kwargs):
-        return self._decorator(plt.tight_layout, *args, **kwargs)
+        """
+            Fit the axes to the active figure, only if the axis text, limits,
+            or figure size changed since the last time. In a transaction, wait
+            until the end.
+        """
+        fig = self.gcf()
+        if self._depth > 0:
+            self._layout[fig] = (args, kwargs)
+        else:
+            self._tight_layout(fig, *args, **kwargs)
+
+    # ======================================================================= #
+    @contextmanager
+    def transaction(self):
+        """
+            Group drawing commands (ex: of one button press) so that each
+            figure is laid out and redrawn once, at the end. Can be nested.
+
+            with plttracker.transaction():
+                ...
+        """
+
+        # stop redrawing after each change
+        if self._depth == 0:
+            self.last_action = {'ndraws':0, 'nlayouts':0}
+            for fig in self._get_figures():
+                self._suspend(fig)
+
+        self._depth += 1
+        try:
+            yield self
+        finally:
+            self._depth -= 1
+            if self._depth == 0:
+                self._flush()
 
     # ======================================================================= #
     def xlabel(self, *args, **kwargs):
@@ -0,0 +1,417 @@
+# Copy images from the camera computers in the background
+# Derek Fujimoto
+# Oct 2026
+
+import os
+import queue
+import sqlite3
+import subprocess
+import tempfile
+import threading
+from bccd.backend.Catalog import Catalog
+
+# =========================================================================== #
+class RemoteSync(object):
+    """
+        Copy files from remote locations to a local mirror with rsync. All
+        remotes are copied at the same time, each in its own thread, and
+        progress is queued for the caller to collect with get (ex: from a Tk
+        after loop). The local mirror can be used while copying.
+
+        Remotes are rsync sources (ex: user@host:/path, or a local directory).
+        Each is copied to a subdirectory of local named by the user@host part,
+        or by the last directory for local sources.
+
+        With a manifest, the remote files already copied are remembered, and
+        only part of each remote is listed: directories whose modification
+        time changed since the last sync, and the newest directory (by name
+        and by modification time) at each level, which holds today's images.
+        Only new or changed files are copied, and then added to the catalog.
+        The whole tree is listed on the first sync, or if full is set.
+
+        Data Fields:
+
+            catalog:    str, path of Catalog database to add new files to, or
+                        None
+            local:      str, local directory
+            manifest:   str, path of database of files already copied, or
+                        None to copy the whole tree each time
+            nlisted:    dict, {remote: number of remote files and directories
+                        listed} in the last sync
+            options:    list of str, rsync options
+            processes:  dict, {remote: Popen} of the running listings and 
+                        copies
+            queue:      Queue of (remote, message, returncode) tuples.
+                        returncode is None while copying, and message is the
+                        last line of rsync output
+            remotes:    list of str, rsync sources
+            returncodes: dict, {remote: returncode} of finished copies
+            threads:    list of Threads, one per remote
+    """
+
+    # rsync executable
+    command = 'rsync'
+
+    # default rsync options
+    default_options = ('-az',
+                       '--progress',
+                       '--update',
+                       '--inplace',
+                       '--human-readable')
+
+    # ======================================================================= #
+    def __init__(self, remotes, local, options=None, manifest=None,
+                 catalog=None):
+        """
+            remotes:    list of rsync sources
+            local:      local directory
+            options:    list of rsync options. If None, use default_options
+            manifest:   path of database of files already copied. If None,
+                        copy the whole tree each time
+            catalog:    path of Catalog database to add new files to
+        """
+
+        self.remotes = list(remotes)
+        self.local = local
+        self.manifest = manifest
+        self.catalog = catalog
+
+        if options is None:
+            options = self.default_options
+        self.options = list(options)
+
+        if manifest is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(manifest)), exist_ok=True)
+            with sqlite3.connect(manifest) as con:
+                con.execute('CREATE TABLE IF NOT EXISTS files ('
+                            'remote TEXT, '
+                            'path TEXT, '
+                            'isdir INTEGER, '
+                            'size INTEGER, '
+                            'mtime TEXT, '
+                            'PRIMARY KEY (remote, path))')
+            con.close()
+
+        self.nlisted = {}
+        self.processes = {}
+        self.queue = queue.Queue()
+        self.returncodes = {}
+        self.threads = []
+        self._stop = threading.Event()
+
+    # ======================================================================= #
+    def _changed(self, remote, full=False):
+        """
+            List the remote, and compare with the manifest
+
+            full:       if True, list the whole tree
+
+            returns: (entries, filenames), where entries are the listed
+                     {path: (isdir, size, mtime)}, and filenames are the paths
+                     of new or changed files, relative to the remote
+        """
+
+        con = sqlite3.connect(self.manifest)
+        known = {row[0]: (bool(row[1]), row[2], row[3]) for row in
+                 con.execute('SELECT path, isdir, size, mtime FROM files '
+                             'WHERE remote=?', (remote, ))}
+        con.close()
+
+        # whole tree
+        if full or not known:
+            entries = self._list(remote, recursive=True)
+
+        # descend into changed or newest directories
+        else:
+            entries = {}
+            stack = ['']
+            while stack:
+
+                if self._stop.is_set():
+                    raise RuntimeError('stopped')
+
+                listing = self._list(remote, stack.pop())
+                entries.update(listing)
+
+                dirs = [(path, value[2]) for path, value in listing.items()
+                        if value[0]]
+                if not dirs:
+                    continue
+
+                newest = {max(dirs)[0], max(dirs, key=lambda d: d[1])[0]}
+                stack.extend(path for path, mtime in dirs
+                             if path in newest or known.get(path) != listing[path])
+
+        self.nlisted[remote] = len(entries)
+
+        filenames = [path for path, value in entries.items()
+                     if not value[0] and known.get(path) != value]
+
+        return (entries, sorted(filenames))
+
+    # ======================================================================= #
+    def _list(self, remote, path='', recursive=False):
+        """
+            List a remote directory with rsync --list-only
+
+            path:       directory, relative to the remote
+            recursive:  if True, list all subdirectories
+
+            returns: {path: (isdir, size, mtime)}, with paths relative to the
+                     remote. Links are skipped.
+        """
+
+        source = remote.rstrip('/')+'/'
+        if path:
+            source += path+'/'
+
+        cmd = [self.command, '--list-only']
+        if recursive:
+            cmd.append('-r')
+        cmd.append(source)
+
+        # a process, so that stop can end it
+        process = self._popen(remote, cmd, stderr=subprocess.PIPE)
+        stdout, stderr = process.communicate()
+
+        if self._stop.is_set():
+            raise RuntimeError('stopped')
+
+        if process.returncode != 0:
+            raise RuntimeError(stderr.strip() or
+                               'listing exit code %d' % process.returncode)
+
+        # lines are: permissions size date time name
+        entries = {}
+        for line in stdout.splitlines():
+            columns = line.split(None, 4)
+            if len(columns) < 5 or columns[4] == '.' or columns[0][0] not in 'd-':
+                continue
+
+            permissions, size, date, time, name = columns
+            entries[os.path.join(path, name)] = (permissions[0] == 'd',
+                                                 int(size.replace(',', '')),
+                                                 date+' '+time)
+
+        return entries
+
+    # ======================================================================= #
+    def _popen(self, remote, cmd, stderr=subprocess.STDOUT):
+        """
+            Start a process for a remote, which is ended by stop
+
+            returns: Popen, with text stdout
+        """
+
+        process = subprocess.Popen(cmd,
+                                   stdin=subprocess.DEVNULL,
+                                   stdout=subprocess.PIPE,
+                                   stderr=stderr,
+                                   text=True)
+        self.processes[remote] = process
+
+        # stopped while starting
+        if self._stop.is_set():
+            process.terminate()
+
+        return process
+
+    # ======================================================================= #
+    def _rsync(self, remote, filenames=None):
+        """
+            Copy files, queueing each line of rsync output
+
+            filenames:  list of paths relative to the remote. If None, copy the
+                        whole tree
+
+            returns: rsync exit code
+        """
+
+        dest = self.destination(remote)
+        os.makedirs(dest, exist_ok=True)
+
+        # trailing slash: copy the contents of remote into dest
+        cmd = [self.command, *self.options]
+
+        if filenames is not None:
+            fid = tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False)
+            fid.write('\n'.join(filenames)+'\n')
+            fid.close()
+            cmd.append('--files-from=%s' % fid.name)
+
+        cmd.extend((remote.rstrip('/')+'/', dest))
+
+        try:
+            process = self._popen(remote, cmd)
+
+            for line in process.stdout:
+                line = line.strip()
+                if line:
+                    self.queue.put((remote, line, None))
+
+            return process.wait()
+
+        finally:
+            if filenames is not None:
+                os.remove(fid.name)
+
+    # ======================================================================= #
+    def _sync(self, remote, full=False):
+        """Copy a remote, and queue the exit code when done"""
+
+        try:
+            # whole tree: copied files are not known, scan the catalog
+            if self.manifest is None:
+                returncode = self._rsync(remote)
+                message = 'done'
+
+                if returncode == 0 and self.catalog is not None:
+                    catalog = Catalog(self.local, self.catalog)
+                    catalog.update()
+                    catalog.connection.close()
+
+            # new files only
+            else:
+                entries, filenames = self._changed(remote, full)
+
+                if self._stop.is_set():
+                    raise RuntimeError('stopped')
+
+                if filenames:
+                    self.queue.put((remote, '%d new files' % len(filenames), None))
+                    returncode = self._rsync(remote, filenames)
+                else:
+                    returncode = 0
+
+                message = '%d new files' % len(filenames)
+
+                if returncode == 0:
+                    self._update(remote, entries, filenames)
+
+            if returncode != 0:
+                message = 'failed with exit code %d' % returncode
+
+        except Exception as err:
+            returncode = -1
+            message = 'failed: %s' % err
+
+        self.returncodes[remote] = returncode
+        self.queue.put((remote, message, returncode))
+
+    # ======================================================================= #
+    def _update(self, remote, entries, filenames):
+        """
+            Save listed entries to the manifest, and add copied files to the
+            catalog. Copied files include those rewritten in place, which
+            keep their directory's modification time
+        """
+
+        with sqlite3.connect(self.manifest) as con:
+            con.executemany('INSERT OR REPLACE INTO files VALUES (?,?,?,?,?)',
+                            [(remote, path, *value) for path, value in
+                             entries.items()])
+        con.close()
+
+        if self.catalog is not None and filenames:
+            dest = self.destination(remote)
+            catalog = Catalog(self.local, self.catalog)
+            catalog.add([os.path.join(dest, f) for f in filenames])
+            catalog.connection.close()
+
+    # ======================================================================= #
+    def destination(self, remote):
+        """
+            Get the local directory where a remote is copied to
+
+            returns: path
+        """
+
+        # user@host:path
+        host, sep, path = remote.partition(':')
+        if sep and '/' not in host:
+            name = host
+
+        # local directory
+        else:
+            name = os.path.basename(os.path.normpath(remote))
+
+        return os.path.join(self.local, name)
+
+    # ======================================================================= #
+    def get(self):
+        """
+            Get progress without waiting
+
+            returns: list of (remote, message, returncode), see self.queue
+        """
+
+        output = []
+        while True:
+            try:
+                output.append(self.queue.get_nowait())
+            except queue.Empty:
+                return output
+
+    # ======================================================================= #
+    def is_alive(self):
+        """True if any remote is still copying"""
+        return any(t.is_alive() for t in self.threads)
+
+    # ======================================================================= #
+    def start(self, full=False):
+        """
+            Start copying all remotes, unless already copying
+
+            full:   if True, list the whole remote trees, and not only the
+                    directories which changed since the last sync
+
+            returns: False if already copying, else True
+        """
+
+        if self.is_alive():
+            return False
+
+        self.nlisted = {}
+        self.processes = {}
+        self.returncodes = {}
+        self.threads = []
+        self._stop.clear()
+
+        for remote in self.remotes:
+            thread = threading.Thread(target=self._sync, args=(remote, full),
+                                      daemon=True, name='bccd-sync')
+            thread.start()
+            self.threads.append(thread)
+
+        return True
+
+    # ======================================================================= #
+    def stop(self, timeout=1):
+        """
+            Stop listing and copying
+
+            timeout:    seconds to wait for each remote. Threads which are
+                        still running are daemons, and don't keep python from
+                        exiting
+        """
+
+        self._stop.set()
+
+        for process in tuple(self.processes.values()):
+            if process.poll() is None:
+                process.terminate()
+
+        self.wait(timeout)
+
+    # ======================================================================= #
+    def wait(self, timeout=None):
+        """
+            Wait for copying to finish
+
+            timeout:    seconds to wait for each remote
+
+            returns: dict, {remote: returncode} of finished copies
+        """
+        for thread in self.threads:
+            thread.join(timeout)
+        return dict(self.returncodes)
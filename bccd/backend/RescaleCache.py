@@ -0,0 +1,161 @@
+# Persistent on-disk cache of rescaled images
+# Derek Fujimoto
+# Oct 2026
+
+import os
+import hashlib
+import threading
+import numpy as np
+
+# =========================================================================== #
+class RescaleCache(object):
+    """
+        Content-addressed cache of rescaled image arrays, stored as .npy files
+        and reopened as read-only memory maps.
+
+        Entries are keyed by file path, size, modification time and the rescale
+        settings, so a file which changes on disk is never served stale. The
+        least recently used entries are evicted when the cache grows beyond
+        max_bytes.
+
+        Data Fields:
+
+            hits:       int, number of cache hits
+            max_bytes:  int, maximum size of the cache on disk
+            misses:     int, number of cache misses
+            path:       str, directory in which to store the cache files
+    """
+
+    # default location and size
+    path = os.path.join(os.environ['HOME'], '.bccd', '.cache')
+    max_bytes = 2*1024**3
+
+    # ======================================================================= #
+    def __init__(self, path=None, max_bytes=None):
+        """
+            path:       directory in which to store the cache files
+            max_bytes:  maximum size of the cache on disk
+        """
+
+        if path is not None:
+            self.path = path
+        if max_bytes is not None:
+            self.max_bytes = max_bytes
+
+        self.hits = 0
+        self.misses = 0
+
+    # ======================================================================= #
+    def _entries(self):
+        """
+            Get list of (access time, size, filename) for all cache files
+        """
+        try:
+            files = os.scandir(self.path)
+        except FileNotFoundError:
+            return []
+
+        entries = []
+        for f in files:
+            if f.name.endswith('.npy'):
+                stat = f.stat()
+                entries.append((stat.st_mtime, stat.st_size, f.path))
+        return entries
+
+    # ======================================================================= #
+    def clear(self):
+        """Remove all cache files"""
+        for _, _, filename in self._entries():
+            os.remove(filename)
+
+    # ======================================================================= #
+    def evict(self):
+        """
+            Remove least recently used entries until the cache is under
+            max_bytes
+        """
+
+        entries = sorted(self._entries())
+        total = sum(e[1] for e in entries)
+
+        for _, size, filename in entries:
+            if total <= self.max_bytes:
+                break
+
+            try:
+                os.remove(filename)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    # ======================================================================= #
+    def get(self, key):
+        """
+            Fetch array from the cache
+
+            key:        string, as generated by self.key
+            returns:    read-only memory-mapped array, or None if not found
+        """
+
+        filename = os.path.join(self.path, key+'.npy')
+
+        try:
+            data = np.load(filename, mmap_mode='r')
+        except (FileNotFoundError, ValueError, OSError):
+            self.misses += 1
+            return None
+
+        # mark as recently used
+        os.utime(filename)
+        self.hits += 1
+        return data
+
+    # ======================================================================= #
+    def key(self, filename, *settings):
+        """
+            Make cache key for a file
+
+            filename:   path to the image file
+            settings:   other values which change the cached output (ex: rescale
+                        factors and spline order)
+            returns:    string
+        """
+
+        filename = os.path.abspath(filename)
+        stat = os.stat(filename)
+
+        keystr = repr((filename, stat.st_size, stat.st_mtime_ns, settings))
+        return hashlib.sha1(keystr.encode()).hexdigest()
+
+    # ======================================================================= #
+    def put(self, key, data):
+        """
+            Save array to the cache
+
+            key:    string, as generated by self.key
+            data:   numpy array to save
+        """
+
+        os.makedirs(self.path, exist_ok=True)
+        filename = os.path.join(self.path, key+'.npy')
+
+        # write to a temporary file first to avoid reading partial files
+        tempfile = '%s.%d.%d.tmp' % (filename, os.getpid(), threading.get_ident())
+        with open(tempfile, 'wb') as fid:
+            np.save(fid, np.asarray(data))
+        os.replace(tempfile, filename)
+
+        self.evict()
+
+    # ======================================================================= #
+    def stats(self):
+        """
+            Get cache statistics
+
+            returns: dict with keys hits, misses, nfiles, nbytes
+        """
+        entries = self._entries()
+        return {'hits':     self.hits,
+                'misses':   self.misses,
+                'nfiles':   len(entries),
+                'nbytes':   sum(e[1] for e in entries)}
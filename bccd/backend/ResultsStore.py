@@ -0,0 +1,233 @@
+# Persistent store of analysis results
+# Derek Fujimoto
+# Oct 2026
+
+import os
+import json
+import time
+import hashlib
+import sqlite3
+
+# =========================================================================== #
+class ResultsStore(object):
+    """
+        Persistent SQLite store of analysis results, keyed by file content,
+        analysis version, and analysis parameters, so that unchanged files are
+        never analyzed twice.
+
+        Files are identified by a hash of their contents, which is only
+        recalculated if the file size or modification time changes. Results
+        follow a file which is moved or copied.
+
+        Data Fields:
+
+            connection: sqlite3 connection to the database
+            hits:       int, number of results found
+            misses:     int, number of results not found
+            path:       str, database filename
+    """
+
+    # default location
+    path = os.path.join(os.environ['HOME'], '.bccd', '.results.sqlite')
+
+    # bytes to read at a time when hashing
+    block_size = 1024**2
+
+    # ======================================================================= #
+    def __init__(self, path=None):
+        """
+            path:   database filename
+        """
+
+        if path is not None:
+            self.path = path
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.connection = sqlite3.connect(self.path)
+
+        with self.connection as con:
+            con.execute('CREATE TABLE IF NOT EXISTS files ('
+                        'path TEXT PRIMARY KEY, '
+                        'size INTEGER, '
+                        'mtime INTEGER, '
+                        'hash TEXT)')
+            con.execute('CREATE TABLE IF NOT EXISTS results ('
+                        'hash TEXT, '
+                        'version TEXT, '
+                        'params TEXT, '
+                        'record TEXT, '
+                        'time REAL, '
+                        'PRIMARY KEY (hash, version, params))')
+
+        self.hits = 0
+        self.misses = 0
+
+    # ======================================================================= #
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+
+    # ======================================================================= #
+    def _hash_file(self, filename):
+        """Hash of the file contents"""
+        digest = hashlib.blake2b(digest_size=20)
+        with open(filename, 'rb') as fid:
+            for block in iter(lambda: fid.read(self.block_size), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    # ======================================================================= #
+    def _params(self, params):
+        """Canonical string for a dict of analysis parameters"""
+        return json.dumps(params, sort_keys=True)
+
+    # ======================================================================= #
+    def clear(self):
+        """Remove all results"""
+        with self.connection as con:
+            con.execute('DELETE FROM results')
+            con.execute('DELETE FROM files')
+
+    # ======================================================================= #
+    def find(self, filename, version=None, compute=True):
+        """
+            Get the most recent result for a file, with any parameters
+
+            filename:   path to image file
+            version:    analysis version. If None, any version
+            compute:    if False, don't hash the file if it is new or changed
+                        (ex: in the gui thread), and return None
+
+            returns: (params, record) or None if not found
+        """
+
+        try:
+            filehash = self.hash(filename, compute=compute)
+        except OSError:
+            return None
+
+        if filehash is None:
+            return None
+
+        cmd = 'SELECT params, record FROM results WHERE hash=?'
+        values = [filehash]
+        if version is not None:
+            cmd += ' AND version=?'
+            values.append(version)
+        cmd += ' ORDER BY time DESC LIMIT 1'
+
+        row = self.connection.execute(cmd, values).fetchone()
+        if row is None:
+            return None
+
+        record = json.loads(row[1])
+        record['filename'] = filename
+        return (json.loads(row[0]), record)
+
+    # ======================================================================= #
+    def get(self, filenames, version, params):
+        """
+            Get stored results
+
+            filenames:  list of paths to image files
+            version:    str, analysis version
+            params:     dict, analysis parameters (json-serializable)
+
+            returns: list of records (dict) or None where not found
+        """
+
+        params = self._params(params)
+        hashes = self.hashes(filenames)
+
+        records = []
+        for filename, filehash in zip(filenames, hashes):
+
+            row = None
+            if filehash is not None:
+                row = self.connection.execute('SELECT record FROM results WHERE '
+                                              'hash=? AND version=? AND params=?',
+                                              (filehash, version, params)).fetchone()
+
+            if row is None:
+                self.misses += 1
+                records.append(None)
+            else:
+                self.hits += 1
+                record = json.loads(row[0])
+                record['filename'] = filename
+                records.append(record)
+
+        return records
+
+    # ======================================================================= #
+    def hash(self, filename, compute=True):
+        """
+            Get the hash of a file's contents, calculating it only if the file
+            changed since the last call
+
+            compute:    if False, return None instead of calculating
+
+            returns: hex string
+        """
+        return self.hashes([filename], compute=compute)[0]
+
+    # ======================================================================= #
+    def hashes(self, filenames, compute=True):
+        """
+            Get the hashes of many files' contents, calculating them only for
+            files which changed since the last call
+
+            compute:    if False, return None instead of calculating
+
+            returns: list of hex strings, None for missing files
+        """
+
+        hashes = []
+        rows = []
+        for filename in filenames:
+            path = os.path.abspath(filename)
+
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                hashes.append(None)
+                continue
+
+            old = self.connection.execute('SELECT size, mtime, hash FROM files '
+                                          'WHERE path=?', (path, )).fetchone()
+            if old is not None and old[:2] == (stat.st_size, stat.st_mtime_ns):
+                hashes.append(old[2])
+                continue
+
+            if not compute:
+                hashes.append(None)
+                continue
+
+            filehash = self._hash_file(path)
+            rows.append((path, stat.st_size, stat.st_mtime_ns, filehash))
+            hashes.append(filehash)
+
+        if rows:
+            with self.connection as con:
+                con.executemany('INSERT OR REPLACE INTO files VALUES (?,?,?,?)', rows)
+
+        return hashes
+
+    # ======================================================================= #
+    def put(self, records, version, params):
+        """
+            Save results
+
+            records:    list of dict, each with key "filename"
+            version:    str, analysis version
+            params:     dict, analysis parameters (json-serializable)
+        """
+
+        params = self._params(params)
+        hashes = self.hashes([r['filename'] for r in records])
+        now = time.time()
+
+        rows = [(filehash, version, params, json.dumps(record), now)
+                for filehash, record in zip(hashes, records) if filehash is not None]
+
+        with self.connection as con:
+            con.executemany('INSERT OR REPLACE INTO results VALUES (?,?,?,?,?)', rows)
@@ -3,21 +3,27 @@
 # Sep 2020 
 
 import matplotlib.patches as patches
+from abc import ABC, abstractmethod
 from functools import partial
 import numpy as np
+import time
 import tkinter as tk
 from tkinter import ttk
+from bccd.backend import overlap
 
-class Target(object):
+class Target(ABC):
     
     """
-        Drawing shapes on lots of figures
+        Drawing shapes on lots of figures. Subclasses define the shape with 
+        get_target.
         
         Data fields:
             ax_list: list of axis
             bccd: bccd object
             color: string, maplotlib color name for coloring everything
             figures: list of figures to update
+            result_overlap: StringVar, fraction of the beam in the active 
+                            figure within the target
             result_frame: ttk Frame object to update text on properties
             popup_target: popup_target object
             points: list of all DraggablePoints
@@ -35,6 +41,13 @@ class Target(object):
         self.result_entry = []
         self.pt_center = None
         
+        # beam overlap, below the shape parameters
+        self.result_overlap = tk.StringVar()
+        ttk.Label(self.result_frame, text='overlap = ').grid(column=0, row=10, 
+                                                             padx=5, pady=5)
+        ttk.Label(self.result_frame, textvariable=self.result_overlap).grid(column=1, 
+                                                row=10, padx=5, pady=5, sticky='w')
+        
     # ======================================================================= #
     def disable_drag_points(self):
         """
@@ -48,6 +61,7 @@ class Target(object):
                     pt.set_markersize(0)
                 except Exception:
                     pass
+                HandleDispatcher.get(pt.figure.canvas).invalidate()
         
     # ======================================================================= #
     def draw(self, ax):
@@ -64,6 +78,61 @@ class Target(object):
                 
         # add axes to list
         self.ax_list.append(ax)
+        self.update_overlap()
+        
+    # ======================================================================= #
+    def get_artists(self):
+        """
+            Get the patches and points drawn in each axis
+            
+            returns: dict, {axis: list of artists}
+        """
+        artists = {ax: [] for ax in self.ax_list}
+        
+        for artist in self.patches + [pt for d in self.points for pt in d.points]:
+            if artist.axes in artists:
+                artists[artist.axes].append(artist)
+        
+        return artists
+        
+    # ======================================================================= #
+    def get_overlap(self, par):
+        """
+            Fraction of a gaussian2D beam within the target
+            
+            par: gaussian2D parameters (x0, y0, sigmax, sigmay, amp, theta)
+            returns: float, nan if the shape parameters are not numbers
+        """
+        try:
+            shape, *parameters = self.get_target()
+        except ValueError:
+            return np.nan
+        
+        return float(getattr(overlap, shape)(par, *parameters))
+        
+    # ======================================================================= #
+    @abstractmethod
+    def get_target(self):
+        """
+            Get the shape and its parameters, as for analysis targets (see 
+            analysis.target_shapes) and the functions in overlap
+            
+            returns: (shape, *parameters), angles in radians
+            raises ValueError if the typed parameters are not numbers
+        """
+        
+    # ======================================================================= #
+    def update_overlap(self, *args):
+        """
+            Show the overlap with the beam in the active figure, or nothing if 
+            its position is not known
+        """
+        par = self.bccd.get_beam()
+        
+        if par is None:
+            self.result_overlap.set('')
+        else:
+            self.result_overlap.set(f'{self.get_overlap(par):.4f}')
         
     # ======================================================================= #
     def enable_drag_points(self):
@@ -75,6 +144,7 @@ class Target(object):
             for pt in dragpt.points: 
                 pt.set_pickradius(DraggablePoint.size)
                 pt.set_markersize(DraggablePoint.size)
+                HandleDispatcher.get(pt.figure.canvas).invalidate()
         
     # ======================================================================= #
     def remove(self, *args, ax=None):
@@ -89,10 +159,9 @@ class Target(object):
             pt.remove(ax)
             
         # remove patches
-        for patch in ax.patches:
-            if patch in self.patches:
-                ax.patches.remove(patch)
-                self.patches.remove(patch)
+        for patch in [p for p in self.patches if p.axes is ax]:
+            self.patches.remove(patch)
+            patch.remove()
         
         # remove axis from list
         self.ax_list.remove(ax)
@@ -186,6 +255,7 @@ class Circle(Target):
             entry.grid(column=1, row=i, padx=5, pady=5)
             
             self.result_entry.append(entry)
+            fields[i].trace_add('write', self.update_overlap)
         
         # place circle at the center of the window
         self.patches = []
@@ -221,6 +291,12 @@ class Circle(Target):
         self.pt_center.add_ax(ax, x, y)
         self.pt_radius.add_ax(ax, x+r, y, )
 
+    # ======================================================================= #
+    def get_target(self):
+        """Get ('circle', x, y, r)"""
+        return ('circle', float(self.x.get()), float(self.y.get()), 
+                          float(self.r.get()))
+        
     # ======================================================================= #
     def update_center(self, x, y, do_set=True):
         """
@@ -322,6 +398,7 @@ class Square(Target):
             entry.grid(column=1, row=i, padx=5, pady=5)
             
             self.result_entry.append(entry)
+            fields[i].trace_add('write', self.update_overlap)
         
         # place circle at the center of the window
         self.patches = []
@@ -362,6 +439,12 @@ class Square(Target):
         self.pt_center.add_ax(ax, x, y)
         self.pt_side.add_ax(ax, x+side/2, y)
        
+    # ======================================================================= #
+    def get_target(self):
+        """Get ('square', x, y, side)"""
+        return ('square', float(self.x.get()), float(self.y.get()), 
+                          float(self.side.get()))
+        
     # ======================================================================= #
     def update_center(self, x, y, do_set=True):
         """
@@ -467,6 +550,7 @@ class Rectangle(Target):
             entry.grid(column=1, row=i, padx=5, pady=5)
             
             self.result_entry.append(entry)
+            fields[i].trace_add('write', self.update_overlap)
         
         # place circle at the center of the window
         self.patches = []
@@ -515,6 +599,12 @@ class Rectangle(Target):
         self.pt_br.add_ax(ax, x+dx, y-dy)
         self.pt_bl.add_ax(ax, x-dx, y-dy)
         
+    # ======================================================================= #
+    def get_target(self):
+        """Get ('rectangle', x, y, dx, dy)"""
+        return ('rectangle', float(self.x.get()), float(self.y.get()), 
+                             float(self.dx.get()), float(self.dy.get()))
+        
     # ======================================================================= #
     def update_typed(self, _):
         """
@@ -702,6 +792,7 @@ class Ellipse(Target):
             entry.grid(column=1, row=i, padx=5, pady=5)
             
             self.result_entry.append(entry)
+            fields[i].trace_add('write', self.update_overlap)
         
         # place circle at the center of the window
         self.patches = []
@@ -748,6 +839,13 @@ class Ellipse(Target):
         self.pt_radius2.add_ax(ax,  x+r2*np.sin(angle), 
                                     y+r2*np.cos(angle))
 
+    # ======================================================================= #
+    def get_target(self):
+        """Get ('ellipse', x, y, r1, r2, angle)"""
+        return ('ellipse', float(self.x.get()), float(self.y.get()), 
+                           float(self.r1.get()), float(self.r2.get()), 
+                           float(self.angle.get())*np.pi/180)
+        
     # ======================================================================= #
     def update_center(self, x, y, do_set=True):
         """
@@ -944,12 +1042,41 @@ class Ellipse(Target):
         self.update_radius2(r2_x, r2_y, False)
     
 class DraggablePoint:
+    """
+        Point which can be dragged with the mouse, moving the target shape in 
+        all the axes it is drawn in. Mouse events are passed on by the 
+        HandleDispatcher of each canvas. 
+        
+        While dragging, each figure is drawn once without the target and 
+        saved, and on each mouse motion only the target is drawn over the 
+        saved background (blitting), so the image is not redrawn. 
+        
+        Mouse motion is coalesced: the target is moved to the latest mouse 
+        position at most once per frame_interval, skipping the positions in 
+        between, and the Tk entries are set at most once per entry_interval. 
+        The exact position is set on release. 
+        
+        Data fields: 
+            background: dict, {canvas: saved background} while dragging, 
+                        else None
+            position:   (x, y), last mouse position while dragging
+            stats:      dict, counts and frame times of the last drag, see 
+                        get_stats
+            timer:      matplotlib timer for the next frame, or None
+    """
 
     # http://stackoverflow.com/questions/21654008/matplotlib-drag-overlapping-points-interactively
     # https://stackoverflow.com/questions/28001655/draggable-line-with-draggable-points
+    # https://matplotlib.org/stable/users/explain/animations/blitting.html
     
     lock = None #  only one can be animated at a time
     size=8
+    
+    # seconds between moves of the target while dragging (screen refresh)
+    frame_interval = 1/60
+    
+    # seconds between updates of the Tk entries while dragging
+    entry_interval = 0.1
 
     # ======================================================================= #
     def __init__(self, parent, updatefn, setx=True, sety=True, color=None, marker='s'):
@@ -958,7 +1085,8 @@ class DraggablePoint:
             points: list of point objects, corresponding to the various axes 
                     the target is drawn in 
             updatefn: funtion which updates the line in the corpatchest way
-                updatefn(xdata, ydata)
+                updatefn(xdata, ydata, do_set), setting the Tk entries if 
+                do_set
             x, y: initial point position
             setx, sety: if true, allow setting this parameter
             color: point color
@@ -973,18 +1101,115 @@ class DraggablePoint:
         self.sety = sety
         self.press = None
         self.background = None
+        self.position = None
+        self.timer = None
+        self.stats = None
+        self._pending = False
+        self._last_entry = 0
+        self._last_frame = 0
+        
+    # ======================================================================= #
+    def _blit(self):
+        """Draw only the target over the saved backgrounds"""
+        
+        artists = self.parent.get_artists()
+        canvases = {ax.figure.canvas for ax in artists}
+        
+        # figures which can't blit, or which were not saved
+        for canvas in tuple(canvases):
+            if canvas not in self.background:
+                canvas.draw_idle()
+                canvases.remove(canvas)
+        
+        for canvas in canvases:
+            canvas.restore_region(self.background[canvas])
+        
+        for ax, artist_list in artists.items():
+            if ax.figure.canvas in canvases:
+                for artist in artist_list:
+                    ax.draw_artist(artist)
+        
+        for canvas in canvases:
+            canvas.blit(canvas.figure.bbox)
+        
+    # ======================================================================= #
+    def _frame(self, final=False):
+        """
+            Move the target to the last mouse position, setting the Tk entries 
+            if entry_interval has passed
+            
+            final: if True, always set the Tk entries
+        """
+        
+        self.timer = None
+        
+        if self.position is None or not (self._pending or final):
+            return
+        
+        self._pending = False
+        start = time.perf_counter()
+        x, y = self.position
+        
+        # move the point
+        if self.setx:   self.set_xdata(x)
+        if self.sety:   self.set_ydata(y)
+        
+        # update the line, and the entries if not too recent
+        do_set = final or start-self._last_entry >= self.entry_interval
+        self.updatefn(x, y, do_set)
+        
+        if do_set:
+            self._last_entry = start
+            self.stats['nentries'] += 1
+        
+        if self.background is not None:
+            self._blit()
+        
+        self._last_frame = time.perf_counter()
+        self.stats['frame_times'].append(self._last_frame-start)
+    
+    # ======================================================================= #
+    def _start_blit(self):
+        """
+            Draw each figure without the target and save it as the background
+        """
+        
+        self.background = {}
+        artists = self.parent.get_artists()
+        
+        # animated artists are skipped by canvas.draw
+        for ax, artist_list in artists.items():
+            if ax.figure.canvas.supports_blit:
+                for artist in artist_list:
+                    artist.set_animated(True)
+        
+        for ax in artists:
+            canvas = ax.figure.canvas
+            if canvas.supports_blit and canvas not in self.background:
+                canvas.draw()
+                self.background[canvas] = canvas.copy_from_bbox(canvas.figure.bbox)
+        
+        self._blit()
+        
+    # ======================================================================= #
+    def _stop_blit(self):
+        """Draw the target as part of the figures again"""
+        
+        artists = self.parent.get_artists()
+        
+        for artist_list in artists.values():
+            for artist in artist_list:
+                artist.set_animated(False)
+                
+        self.background = None
         
-        # trackers for connections
-        self.cidpress = []
-        self.cidrelease = []
-        self.cidmotion = []
+        for canvas in {ax.figure.canvas for ax in artists}:
+            canvas.draw_idle()
         
     # ======================================================================= #
     def add_ax(self, ax, x=None, y=None):
         """Add axis to list of axes"""
         
-        self.disconnect()
-        
         if x is None:
             x = self.get_xdata()
         if y is None:
@@ -994,52 +1219,55 @@ class DraggablePoint:
                         marker=self.marker, markersize=self.size)[0])
         self.points[-1].set_pickradius(self.size)
         
-        self.connect()
-        
-    # ======================================================================= #
-    def connect(self):
-        """connect to all the events we need"""
+        HandleDispatcher.get(ax.figure.canvas).add(self.points[-1], self)
         
-        # trackers for connections
-        self.cidpress = []
-        self.cidrelease = []
-        self.cidmotion = []
-        
-        for i, pt in enumerate(self.points):
-            self.cidpress.append(pt.figure.canvas.mpl_connect('button_press_event', 
-                                partial(self.on_press, id=i)))
-                                 
-            self.cidrelease.append(pt.figure.canvas.mpl_connect('button_release_event', 
-                                self.on_release))
-                                
-            self.cidmotion.append(pt.figure.canvas.mpl_connect('motion_notify_event', 
-                                partial(self.on_motion, id=i)))
-    
     # ======================================================================= #
     def on_press(self, event, id):
+        """
+            Start dragging. Called by the HandleDispatcher when points[id] is 
+            under the mouse. 
+        """
         
         if event.inaxes != self.points[id].axes: return
         if DraggablePoint.lock is not None: return
-        contains, attrd = self.points[id].contains(event)
-        if not contains: return
         DraggablePoint.lock = self
         
+        self.position = None
+        self._pending = False
+        self._last_entry = 0
+        self._last_frame = 0
+        self.stats = {'nevents': 0, 
+                      'nentries': 0, 
+                      'frame_times': [], 
+                      'start': time.perf_counter(), 
+                      'stop': None}
+        
+        self._start_blit()
+        
     # ======================================================================= #
     def on_motion(self, event, id):
 
         if DraggablePoint.lock is not self: return
         if event.inaxes != self.points[id].axes: return
         
-        # get data
-        x = event.xdata
-        y = event.ydata
+        # keep only the latest position
+        self.stats['nevents'] += 1
+        self.position = (event.xdata, event.ydata)
+        self._pending = True
         
-        # move the point
-        if self.setx:   self.set_xdata(x)
-        if self.sety:   self.set_ydata(y)
-
-        # update the line
-        self.updatefn(x, y)        
+        # a frame is already waiting
+        if self.timer is not None: 
+            return
+        
+        # move now, or when frame_interval has passed
+        wait = self._last_frame + self.frame_interval - time.perf_counter()
+        if wait <= 0:
+            self._frame()
+        else:
+            self.timer = event.canvas.new_timer(interval=max(1, round(wait*1000)))
+            self.timer.single_shot = True
+            self.timer.add_callback(self._frame)
+            self.timer.start()
 
     # ======================================================================= #
     def on_release(self, event):
@@ -1047,15 +1275,39 @@ class DraggablePoint:
         if DraggablePoint.lock is not self: return
         DraggablePoint.lock = None
         
+        if self.timer is not None:
+            self.timer.stop()
+        
+        # exact position and entries
+        self._frame(final=True)
+        self._stop_blit()
+        self.stats['stop'] = time.perf_counter()
+        
     # ======================================================================= #
-    def disconnect(self):
-        'disconnect all the stored connection ids'
+    def get_stats(self):
+        """
+            Get statistics of the last drag
+            
+            returns: dict with keys nevents (mouse motions), nframes (target 
+                     moves), nentries (Tk entry updates), frame_ms (mean time 
+                     to move the target), frame_ms_max, fps (moves per second 
+                     of dragging); or None if not dragged
+        """
         
-        for i, pt in enumerate(self.points):
-            pt.figure.canvas.mpl_disconnect(self.cidpress[i])
-            pt.figure.canvas.mpl_disconnect(self.cidrelease[i])
-            pt.figure.canvas.mpl_disconnect(self.cidmotion[i])
-                
+        if self.stats is None:
+            return None
+        
+        stats = self.stats
+        times = np.array(stats['frame_times'])*1e3
+        stop = stats['stop'] or time.perf_counter()
+        
+        return {'nevents':      stats['nevents'], 
+                'nframes':      len(times), 
+                'nentries':     stats['nentries'], 
+                'frame_ms':     float(np.mean(times)) if len(times) else np.nan, 
+                'frame_ms_max': float(np.max(times)) if len(times) else np.nan, 
+                'fps':          len(times)/(stop-stats['start'])}
+    
     # ======================================================================= #
     def get_xdata(self):
         """Get x coordinate"""
@@ -1071,23 +1323,11 @@ class DraggablePoint:
         """
             Remove drawn points from the axis.
         """
-    
-        self.disconnect()
-        del_list = []
-        
-        # remove from draggable points
-        for i, line in enumerate(ax.lines):
-            for pt in self.points:
-                if line is pt:
-                    del_list.append(i)
-                    self.points.remove(line)
-                    del line
-        
-        # remove from mpl
-        for d in del_list:
-            ax.lines[d].remove()
-        
-        self.connect()
+        
+        for line in [pt for pt in self.points if pt.axes is ax]:
+            HandleDispatcher.get(ax.figure.canvas).remove(line)
+            self.points.remove(line)
+            line.remove()
             
     # ======================================================================= #
     def set_xdata(self, x):
@@ -1100,3 +1340,159 @@ class DraggablePoint:
         """Set y coordinate"""
         for pt in self.points:
             pt.set_ydata([y])
+
+class HandleDispatcher(object):
+    """
+        Mouse events for all the DraggablePoints drawn in one canvas. Press, 
+        motion and release are connected once per canvas, and the point under 
+        the mouse is found by looking up a grid of point positions in display 
+        coordinates, so the cost of an event does not grow with the number of 
+        targets or figures. 
+        
+        The grid is made again on the next press after the canvas is drawn 
+        (ex: zoom, pan, or resize) or the points change. 
+        
+        Data fields: 
+            active: (DraggablePoint, Line2D of its point) being dragged, or None
+            canvas: matplotlib canvas
+            cell:   float, grid spacing in pixels, the largest pick radius
+            cids:   list of matplotlib connection ids
+            grid:   dict, {(column, row): list of (x, y, radius, line)} in 
+                    display coordinates, or None if out of date
+            handles: dict, {line: DraggablePoint} of points in this canvas
+    """
+    
+    # ======================================================================= #
+    def __init__(self, canvas):
+        """Use HandleDispatcher.get to share one per canvas"""
+        
+        self.canvas = canvas
+        self.active = None
+        self.cell = 1
+        self.grid = None
+        self.handles = {}
+        
+        self.cids = [canvas.mpl_connect('button_press_event', self.on_press), 
+                     canvas.mpl_connect('button_release_event', self.on_release), 
+                     canvas.mpl_connect('motion_notify_event', self.on_motion), 
+                     canvas.mpl_connect('draw_event', self.invalidate)]
+        
+    # ======================================================================= #
+    def _make_grid(self):
+        """Bin the visible points by their position in display coordinates"""
+        
+        points = []
+        for line in self.handles.keys():
+            if line.axes is None or not line.get_visible():
+                continue
+            
+            # disabled points have no pick radius
+            radius = line.get_pickradius()*line.figure.dpi/72
+            if radius <= 0:
+                continue
+            
+            xy = (np.ravel(line.get_xdata())[0], np.ravel(line.get_ydata())[0])
+            x, y = line.get_transform().transform(xy)
+            points.append((x, y, radius, line))
+        
+        # points within a radius of the mouse are in neighbouring cells
+        self.cell = max([p[2] for p in points], default=1)
+        self.grid = {}
+        for point in points:
+            key = (int(point[0]//self.cell), int(point[1]//self.cell))
+            self.grid.setdefault(key, []).append(point)
+    
+    # ======================================================================= #
+    @classmethod
+    def get(cls, canvas):
+        """Get the dispatcher of a canvas, making it on first use"""
+        
+        dispatcher = getattr(canvas, 'handle_dispatcher', None)
+        if dispatcher is None:
+            dispatcher = cls(canvas)
+            canvas.handle_dispatcher = dispatcher
+        return dispatcher
+    
+    # ======================================================================= #
+    def add(self, line, dragpoint):
+        """Dispatch events for a point drawn in this canvas"""
+        self.handles[line] = dragpoint
+        self.grid = None
+    
+    # ======================================================================= #
+    def find(self, event):
+        """
+            Find the point under the mouse
+            
+            returns: (DraggablePoint, Line2D of its point) of the nearest 
+                     point within its pick radius, or None
+        """
+        
+        if self.grid is None:
+            self._make_grid()
+        
+        column = int(event.x//self.cell)
+        row = int(event.y//self.cell)
+        
+        nearest = None
+        for i in (column-1, column, column+1):
+            for j in (row-1, row, row+1):
+                for x, y, radius, line in self.grid.get((i, j), ()):
+                    
+                    if line.axes is not event.inaxes:
+                        continue
+                    
+                    d2 = (x-event.x)**2 + (y-event.y)**2
+                    if d2 <= radius**2 and (nearest is None or d2 < nearest[0]):
+                        nearest = (d2, line)
+        
+        if nearest is None:
+            return None
+        
+        return (self.handles[nearest[1]], nearest[1])
+        
+    # ======================================================================= #
+    def invalidate(self, *args):
+        """Point positions changed on screen, make the grid again when needed"""
+        self.grid = None
+        
+    # ======================================================================= #
+    def on_motion(self, event):
+        if self.active is not None:
+            dragpoint, line = self.active
+            dragpoint.on_motion(event, dragpoint.points.index(line))
+        
+    # ======================================================================= #
+    def on_press(self, event):
+        if event.inaxes is None or DraggablePoint.lock is not None:
+            return
+        
+        self.active = self.find(event)
+        if self.active is not None:
+            dragpoint, line = self.active
+            dragpoint.on_press(event, dragpoint.points.index(line))
+    
+    # ======================================================================= #
+    def on_release(self, event):
+        if self.active is None:
+            return
+        
+        dragpoint = self.active[0]
+        self.active = None
+        self.grid = None
+        dragpoint.on_release(event)
+    
+    # ======================================================================= #
+    def remove(self, line):
+        """Stop dispatching events for a point"""
+        
+        # removed while dragging (ex: figure closed)
+        if self.active is not None and self.active[1] is line:
+            dragpoint = self.active[0]
+            if DraggablePoint.lock is dragpoint:
+                dragpoint._stop_blit()
+                DraggablePoint.lock = None
+            self.active = None
+        
+        self.handles.pop(line, None)
+        self.grid = None
@@ -0,0 +1,300 @@
+# Watch the local image archive for new files, analyzing them as they arrive
+# Derek Fujimoto
+# Oct 2026
+
+import os
+import queue
+import threading
+from bccd.backend import analysis
+from bccd.backend.BeamTracker import BeamTracker
+from bccd.backend.Catalog import Catalog
+
+# =========================================================================== #
+class Watcher(object):
+    """
+        Poll a directory tree for new image files. Each new file is loaded and
+        analyzed in a background thread, and the results are queued for the
+        caller to collect with get (ex: from a Tk after loop).
+
+        Polling only lists directories whose modification time changed. A new
+        file is used once its size and modification time are the same on two
+        polls, so that files which are still being written are skipped. Files
+        which can't be read are tried again if they change.
+
+        Data Fields:
+
+            analyses:   list of analyses to run, see analysis.analyze_image
+            catalog:    str, path of Catalog database to add new files to, or
+                        None
+            dirs:       dict, {path: (mtime, subdirectories, image filenames)}
+            failed:     dict, {path: (mtime, size)} of files which could not
+                        be read
+            interval:   float, seconds between polls
+            kwargs:     dict, passed to analysis.load_file
+            nfiles:     int, number of new files analyzed
+            pending:    dict, {path: (mtime, size)} of new files not yet used
+            queue:      Queue of (fits, record) tuples. fits is None if the
+                        file could not be read, with the message in
+                        record['error']. If the file was read but the
+                        analysis failed (ex: no beam in a dark frame), fits
+                        is set, and the message is in record['error']
+            root:       str, top directory to watch
+            targets:    list of targets, see analysis.analyze_image
+            thread:     Thread which polls and analyzes, or None if stopped
+            tracker:    BeamTracker if gaussian2D is warm-started, else None
+    """
+
+    # file extensions to watch
+    extensions = Catalog.extensions
+
+    # ======================================================================= #
+    def __init__(self, root, analyses=('moments', ), targets=(), interval=0.25,
+                 catalog=None, track=True, **kwargs):
+        """
+            root:       top directory to watch
+            analyses:   list of analyses to run, from analysis.analyses
+            targets:    list of (shape, *parameters) tuples, see
+                        analysis.analyze_file
+            interval:   seconds between polls
+            catalog:    path of Catalog database to add new files to
+            track:      if True, fit gaussian2D starting from the last image
+                        (see BeamTracker)
+            kwargs:     passed to analysis.load_file (ex: rescale_pixels, mask)
+        """
+
+        self.root = os.path.abspath(root)
+        self.analyses = analyses
+        self.targets = targets
+        self.interval = interval
+        self.catalog = catalog
+        self.kwargs = kwargs
+        self.tracker = BeamTracker() if track else None
+
+        self.dirs = {}
+        self.failed = {}
+        self.pending = {}
+        self.nfiles = 0
+        self.queue = queue.Queue()
+        self.thread = None
+        self._stop = threading.Event()
+
+    # ======================================================================= #
+    def _analyze(self, filename):
+        """
+            Load and analyze a file
+
+            returns: (fits, record), fits is None if the file can't be read
+        """
+        try:
+            img = analysis.load_file(filename, **self.kwargs)
+
+            # read pixels here and not in the caller's thread
+            img.data_original
+
+        except Exception as err:
+            return (None, {'filename': filename,
+                           'error': '%s: %s' % (type(err).__name__, err)})
+
+        # show the image even if the analysis fails
+        try:
+            record = analysis.analyze_image(img, analyses=self.analyses,
+                                             targets=self.targets,
+                                             tracker=self.tracker)
+        except Exception as err:
+            record = {'filename': filename,
+                      'error': '%s: %s' % (type(err).__name__, err)}
+
+        return (img, record)
+
+    # ======================================================================= #
+    def _poll(self):
+        """
+            Find new files and check if pending files are done being written
+
+            returns: list of paths which are ready, ordered by modification time
+        """
+
+        for filename in self._scan():
+            self.pending.setdefault(filename, None)
+
+        # try failed files again if they changed
+        for filename, old in tuple(self.failed.items()):
+            if self._stat(filename) != old:
+                del self.failed[filename]
+                self.pending.setdefault(filename, None)
+
+        ready = []
+        for filename, old in tuple(self.pending.items()):
+
+            new = self._stat(filename)
+            if new is None:
+                del self.pending[filename]
+            elif new == old and new[1] > 0:
+                ready.append((new[0], filename))
+                del self.pending[filename]
+            else:
+                self.pending[filename] = new
+
+        return [filename for _, filename in sorted(ready)]
+
+    # ======================================================================= #
+    def _run(self):
+        """Poll until stopped"""
+
+        # catalog connections can't be shared between threads
+        if self.catalog is not None:
+            catalog = Catalog(self.root, self.catalog)
+
+        # files already present are marked as seen
+        self._scan()
+
+        while not self._stop.wait(self.interval):
+
+            ready = self._poll()
+            if not ready:
+                continue
+
+            if self.catalog is not None:
+                catalog.add(ready)
+
+            for filename in ready:
+                if self._stop.is_set():
+                    break
+                img, record = self._analyze(filename)
+                if img is None:
+                    self.failed[filename] = self._stat(filename)
+
+                self.queue.put((img, record))
+                self.nfiles += 1
+
+    # ======================================================================= #
+    def _scan(self):
+        """
+            List directories which changed since the last scan
+
+            returns: list of image files which were not there before
+        """
+
+        new = []
+        found = set()
+        stack = [self.root]
+        first = not self.dirs
+
+        while stack:
+            dirpath = stack.pop()
+
+            try:
+                mtime = os.stat(dirpath).st_mtime_ns
+            except (FileNotFoundError, NotADirectoryError, PermissionError):
+                continue
+
+            found.add(dirpath)
+
+            # unchanged directory contents
+            old = self.dirs.get(dirpath, None)
+            if old is not None and old[0] == mtime:
+                stack.extend(old[1])
+                continue
+
+            try:
+                entries = list(os.scandir(dirpath))
+            except (FileNotFoundError, NotADirectoryError, PermissionError):
+                continue
+
+            # skip hidden directories (ex: caches)
+            subdirs = [e.path for e in entries
+                       if e.is_dir() and not e.name.startswith('.')]
+            filenames = {e.name for e in entries if e.is_file() and
+                         os.path.splitext(e.name)[1].lower() in self.extensions}
+
+            # everything is new in a new directory, except on the first scan
+            if old is not None:
+                new.extend(os.path.join(dirpath, f) for f in filenames - old[2])
+            elif not first:
+                new.extend(os.path.join(dirpath, f) for f in filenames)
+
+            self.dirs[dirpath] = (mtime, subdirs, filenames)
+            stack.extend(subdirs)
+
+        # forget removed directories
+        for dirpath in set(self.dirs.keys()) - found:
+            del self.dirs[dirpath]
+
+        return new
+
+    # ======================================================================= #
+    def _stat(self, filename):
+        """returns: (mtime, size) or None if the file doesn't exist"""
+        try:
+            stat = os.stat(filename)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    # ======================================================================= #
+    def get(self, timeout=None):
+        """
+            Get the results for new files
+
+            timeout:    if None, don't wait. Else wait up to timeout seconds
+                        for a result if there are none.
+            returns:    list of (fits, record), in the order the files
+                        arrived
+        """
+
+        output = []
+
+        if timeout is not None:
+            try:
+                output.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                return output
+
+        while True:
+            try:
+                output.append(self.queue.get_nowait())
+            except queue.Empty:
+                return output
+
+    # ======================================================================= #
+    def is_alive(self):
+        """True if watching"""
+        return self.thread is not None and self.thread.is_alive()
+
+    # ======================================================================= #
+    def start(self):
+        """
+            Start watching in a background thread. Files already in the
+            directory when the thread first lists it are ignored.
+        """
+
+        if self.is_alive():
+            return
+
+        self.dirs = {}
+        self.failed = {}
+        self.pending = {}
+
+        if self.tracker is not None:
+            self.tracker.reset()
+
+        self._stop.clear()
+        self.thread = threading.Thread(target=self._run, daemon=True,
+                                       name='bccd-watcher')
+        self.thread.start()
+
+    # ======================================================================= #
+    def stop(self, timeout=None):
+        """
+            Stop watching, after the file being analyzed is done
+
+            timeout:    seconds to wait for the thread to finish. If 0, don't
+                        wait (ex: in the gui thread): the thread ends by itself
+                        and its results are dropped
+        """
+        if self.thread is None:
+            return
+
+        self._stop.set()
+        self.thread.join(timeout)
+        self.thread = None
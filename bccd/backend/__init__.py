@@ -1 +1 @@
-__all__ = ['fits', 'functions', 'PltTracker']
+__all__ = ['analysis', 'fits', 'functions', 'header', 'overlap', 'BeamTracker', 'Catalog', 'ImageLoader', 'ImageStore', 'PltTracker', 'RemoteSync', 'RescaleCache', 'ResultsStore', 'Watcher']
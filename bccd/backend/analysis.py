@@ -0,0 +1,257 @@
+# Headless analysis of image files, without drawing
+# Derek Fujimoto
+# Oct 2026
+
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from bccd.backend.fits import fits
+from bccd.backend import overlap
+
+# available analyses, in the order they are run
+analyses = ('center', 'cm', 'moments', 'gaussian2D')
+
+# increment when results change for the same inputs, to invalidate stored results
+version = '1'
+
+# target shapes for overlap calculations: number of parameters
+target_shapes = {'circle':      3,     # x, y, r
+                 'square':      3,     # x, y, side
+                 'rectangle':   4,     # x, y, dx, dy
+                 'ellipse':     5,     # x, y, r1, r2, angle (radians)
+                 }
+
+# analyze_file options in worker processes, set once by _init_worker
+_worker_kwargs = {}
+
+# =========================================================================== #
+def _add_dataframe(record, prefix, df):
+    """
+        Add DataFrame with result and error columns to record, as
+        prefix_name and prefix_name_err
+    """
+    for name, row in df.iterrows():
+        record['%s_%s' % (prefix, name)] = float(row['result'])
+        record['%s_%s_err' % (prefix, name)] = float(row['error'])
+
+# =========================================================================== #
+def _analyze_worker(filename):
+    """Run analyze_file in a worker process, with options from _init_worker"""
+    return analyze_file(filename, **_worker_kwargs)
+
+# =========================================================================== #
+def _init_worker(kwargs):
+    """
+        Initialize worker process: fits and its dependencies are imported
+        with this module, and the options are sent only once per process
+    """
+    global _worker_kwargs
+    _worker_kwargs = kwargs
+
+# =========================================================================== #
+def analyze_file(filename, analyses=('center', 'gaussian2D'), targets=(),
+                 rescale_pixels=True, use_cache=True, mask=None, black=None):
+    """
+        Run analyses on a single file, without drawing
+
+        filename:       path to .fits file
+        analyses:       list of analyses to run, from bccd.backend.analysis.analyses
+        targets:        list of (shape, *parameters) tuples, where shape is a
+                        key of target_shapes. The overlap with the fitted
+                        gaussian2D is calculated for each (fits gaussian2D if
+                        not in analyses).
+        rescale_pixels: if True, rescale image such that pixels are square
+        use_cache:      if True, use the on-disk cache of rescaled images
+        mask:           (x, y, r) circle outside of which pixels are excluded
+        black:          pixel value to set to black
+
+        returns: dict of column: value. If the analysis fails, column
+                 "error" has the exception message.
+    """
+
+    record = {'filename': filename}
+
+    try:
+        img = load_file(filename, rescale_pixels=rescale_pixels, 
+                        use_cache=use_cache, mask=mask, black=black)
+        record.update(analyze_image(img, analyses=analyses, targets=targets))
+
+    except Exception as err:
+        record['error'] = '%s: %s' % (type(err).__name__, err)
+
+    return record
+
+# =========================================================================== #
+def analyze_files(filenames, nproc=1, chunksize=None, store=None, refresh=False,
+                  **kwargs):
+    """
+        Run analyses on many files, without drawing, spread over a pool of 
+        processes
+        
+        filenames:  list of paths to .fits files
+        nproc:      number of processes. If None, use all cores. If 1, run in 
+                    this process
+        chunksize:  number of files sent to a worker at a time. If None, 
+                    split files into about four chunks per process
+        store:      ResultsStore. If not None, only analyze files without 
+                    stored results for these options, and save new results
+        refresh:    if True, analyze all files and overwrite stored results
+        kwargs:     passed to analyze_file
+        
+        returns: pandas DataFrame, one row per file, in the order of filenames
+    """
+    import pandas as pd
+    
+    filenames = list(filenames)
+    
+    # without stored results
+    if store is None:
+        return pd.DataFrame(map_files(filenames, nproc, chunksize, **kwargs))
+    
+    # find stored results
+    params = get_params(**kwargs)
+    
+    if refresh:
+        stored = [None]*len(filenames)
+    else:
+        stored = store.get(filenames, version, params)
+    
+    # analyze the rest
+    new = [f for f, r in zip(filenames, stored) if r is None]
+    new = map_files(new, nproc, chunksize, **kwargs)
+    
+    # save: failed files are tried again next time
+    store.put([r for r in new if 'error' not in r], version, params)
+    
+    new = iter(new)
+    records = [next(new) if r is None else r for r in stored]
+    
+    return pd.DataFrame(records)
+
+# =========================================================================== #
+def analyze_image(img, analyses=('center', 'gaussian2D'), targets=(), 
+                  tracker=None):
+    """
+        Run analyses on a loaded image, without drawing
+        
+        img:        fits object
+        analyses:   list of analyses to run, from bccd.backend.analysis.analyses
+        targets:    list of (shape, *parameters) tuples, see analyze_file
+        tracker:    BeamTracker. If not None, gaussian2D is fit starting from 
+                    the previous image given to the tracker
+        
+        returns: dict of column: value
+    """
+    
+    record = {'filename': img.filename}
+    record['datetime'] = img.datetime.isoformat()
+    record['exposure'] = img.header.get('EXPOSURE', np.nan)
+
+    for analysis in analyses:
+
+        if analysis == 'center':
+            par, names = img.get_center(draw=False), img.result_center[1]
+            for p, n in zip(par, names):
+                record['center_%s' % n] = float(p)
+
+        elif analysis == 'cm':
+            par, names = img.get_cm(draw=False), img.result_cm[1]
+            for p, n in zip(par, names):
+                record['cm_%s' % n] = float(p)
+
+        elif analysis == 'moments':
+            _add_dataframe(record, 'moments', img.get_moments(draw=False))
+
+        elif analysis == 'gaussian2D':
+            if tracker is None:
+                img.fit_gaussian2D(draw=False)
+                nfev = img.nfev
+            else:
+                tracked = tracker.update(img)
+                nfev = tracked['nfev']
+            
+            _add_dataframe(record, 'gaussian2D', img.result_gaussian2D)
+            record['gaussian2D_chi2'] = float(img.chi2)
+            record['gaussian2D_nfev'] = int(nfev)
+            
+            if tracker is not None:
+                record['gaussian2D_warm'] = tracked['warm']
+
+        else:
+            raise RuntimeError('Unknown analysis "%s"' % analysis)
+
+    # overlap with targets
+    if len(targets) > 0:
+        if 'gaussian2D' not in analyses:
+            img.fit_gaussian2D(draw=False)
+        par = img.result_gaussian2D['result'].values
+
+        for i, (shape, *target) in enumerate(targets):
+            record['overlap_%d' % i] = float(getattr(overlap, shape)(par, *target))
+
+    return record
+
+# =========================================================================== #
+def get_params(analyses=('center', 'gaussian2D'), targets=(), rescale_pixels=True, 
+               use_cache=True, mask=None, black=None):
+    """
+        Get the analyze_file options which change its results, for 
+        ResultsStore
+        
+        returns: dict
+    """
+    return {'analyses':         list(analyses), 
+            'targets':          [list(t) for t in targets], 
+            'rescale_pixels':   bool(rescale_pixels), 
+            'mask':             None if mask is None else list(mask), 
+            'black':            black}
+    
+# =========================================================================== #
+def load_file(filename, rescale_pixels=True, use_cache=True, mask=None, 
+              black=None):
+    """
+        Read an image file for analysis, with options as in analyze_file
+        
+        returns: fits object
+    """
+    
+    img = fits(filename, rescale_pixels=rescale_pixels, use_cache=use_cache)
+
+    if mask is not None:
+        img.set_mask(mask)
+    if black is not None:
+        img.set_black(black)
+    
+    return img
+
+# =========================================================================== #
+def map_files(filenames, nproc=1, chunksize=None, **kwargs):
+    """
+        Run analyze_file on many files, spread over a pool of processes
+        
+        filenames:  list of paths to .fits files
+        nproc:      number of processes. If None, use all cores. If 1, run in 
+                    this process
+        chunksize:  number of files sent to a worker at a time. If None, 
+                    split files into about four chunks per process
+        kwargs:     passed to analyze_file
+        
+        returns: list of records (dict), in the order of filenames
+    """
+    
+    if nproc is None:
+        nproc = os.cpu_count()
+    nproc = max(min(nproc, len(filenames)), 1)
+    
+    # serial
+    if nproc == 1:
+        return [analyze_file(f, **kwargs) for f in filenames]
+    
+    # parallel
+    if chunksize is None:
+        chunksize = max(len(filenames)//(4*nproc), 1)
+    
+    with ProcessPoolExecutor(max_workers=nproc, 
+                             initializer=_init_worker, 
+                             initargs=(kwargs, )) as executor:
+        return list(executor.map(_analyze_worker, filenames, chunksize=chunksize))
@@ -4,16 +4,18 @@
 
 import os
 import numpy as np
-import pandas as pd
 
-from bccd.backend.functions import gaussian2D
-from astropy.io import fits as astrofits
+from bccd.backend.functions import gaussian2D, gaussian2D_jac
+from bccd.backend.header import get_datetime, read_header, is_simple_image, memmap_data
+from bccd.backend import overlap
 
 from scipy.optimize import curve_fit
-from scipy.integrate import dblquad
 
-from bccd.backend.PltTracker import PltTracker
-from matplotlib.patches import Circle
+from bccd.backend.ImageStore import ImageStore
+from bccd.backend.RescaleCache import RescaleCache
+
+# matplotlib, pandas, and astropy are imported on first use so that batch 
+# analysis does not load plotting or gui libraries
 
 import skimage as ski
 from skimage import filters
@@ -22,10 +24,21 @@ from skimage.transform import hough_circle, hough_circle_peaks
 from skimage.transform import probabilistic_hough_line
 from skimage.transform import rescale
 
-from datetime import datetime
-from dateutil import tz
+plt_global = None
+rescale_cache = RescaleCache()
+image_store = ImageStore()
 
-plt_global = PltTracker()
+# =========================================================================== #
+def get_plt_global():
+    """
+        Get the PltTracker shared by fits objects without their own, making 
+        it on first use
+    """
+    global plt_global
+    if plt_global is None:
+        from bccd.backend.PltTracker import PltTracker
+        plt_global = PltTracker()
+    return plt_global
 
 # =========================================================================== #
 class fits(object):
@@ -34,21 +47,34 @@ class fits(object):
         
             black:          float, pixel value corresponding to black (zero)
             chi2:           float, chisquared value from 2D fit
-            data:           2D numpy array, pixel values
-            data_original:  numpy array, pixel values
+            data:           2D masked array, pixel values clipped to black and 
+                            white, with mask applied. Generated on first access
+            data_original:  numpy array, read-only pixel values. Generated on 
+                            first access from the memory-mapped file (or 
+                            rescale cache), and shared by all fits objects of 
+                            the same file (see image_store)
             datetime:       datetime object with the time the image was taken, 
                             in the local time zone
+            derived_hits:   int, number of times a derived product (edges, 
+                            gradients, grids) was fetched from the cache
+            derived_misses: int, number of times a derived product was computed
             filename:       name of the file
+            nbytes:         int, bytes of pixel arrays held in memory, 
+                            including arrays shared with other fits objects
+            nfev:           int, number of function evaluations in last 2D fit
             header:         dict, header information
             
             mask:           (x, y, r) specifying circle to mask on
             
-            plt:            PltTracker object or None
+            plt:            PltTracker object. If not given on construction, 
+                            get_plt_global() on first access
             result_center:      (par, names) fitting results
             result_cm:          (par, names) center of mass results
             result_fit2D:       (par, cov) fitting results
             result_gaussian2D:  (par, cov, names) fitting results
             result_gaussian2D_overlap: float, overlap
+            result_moments:     DataFrame, moment estimates
+            roi:            (ylo, yhi, xlo, xhi) pixel bounds of the last 2D fit
             
         Colormaps: 
             Greys
@@ -65,23 +91,310 @@ class fits(object):
     show_options = {'origin':'lower', 
                     'interpolation':'nearest'}
     
+    # derived products which depend only on the image shape
+    static_products = ('grid', )
+    
+    # derived products which depend only on the mask, not black or white
+    mask_products = ('display_range', )
+    
     # ======================================================================= #
-    def __init__(self, filename, plt=None, rescale_pixels=True):
+    def __init__(self, filename, plt=None, rescale_pixels=True, use_cache=True):
         """
             Read the file
             self.plt: plot tracker
             rescale_pixels: if True, rescale image such that pixels are square
+            use_cache: if True, fetch rescaled image from the on-disk cache
         """
         self.filename = filename
-        self.read(filename, rescale_pixels=rescale_pixels)
-        self.data_original = np.copy(self.data)
+        self.read(filename, rescale_pixels=rescale_pixels, use_cache=use_cache)
         self.set_mask(None)
         
-        if plt is None:
-            self.plt = plt_global
-        else:
-            self.plt = plt
+        self._plt = plt
+        
+    # ======================================================================= #
+    @property
+    def data(self):
+        """Pixel values clipped to black and white levels and masked"""
+        if self._data is None:
+            self._data = self._make_data()
+        return self._data
+    
+    # ======================================================================= #
+    @property
+    def data_original(self):
+        """Pixel values, bad pixels fixed and rescaled"""
+        if self._data_original is None:
+            self._data_original = self._load_data()
+        return self._data_original
+        
+    # ======================================================================= #
+    @property
+    def nbytes(self):
+        """
+            Bytes of pixel arrays held in memory, including masks and derived 
+            products. Memory-mapped arrays (ex: from the rescale cache) are 
+            paged from disk and are not counted. 
+        """
+        return sum(self.get_memory_blocks().values())
+        
+    # ======================================================================= #
+    @property
+    def plt(self):
+        """Plot tracker, shared by default"""
+        if self._plt is None:
+            self._plt = get_plt_global()
+        return self._plt
+    
+    @plt.setter
+    def plt(self, plt):
+        self._plt = plt
+        
+    # ======================================================================= #
+    def _load_data(self):
+        """
+            Get the pixels from the image store, else read them
+            
+            returns: 2D read-only numpy array
+        """
+        
+        key = image_store.key(self._path, self._rescale)
+        data = image_store.get(key)
+        
+        if data is None:
+            data = image_store.put(key, self._read_data())
+        
+        return data
+        
+    # ======================================================================= #
+    def _read_data(self):
+        """
+            Convert the raw pixels to float, fix bad pixels and rescale. 
+            
+            returns: 2D numpy array
+        """
+        
+        # check the cache before touching the pixels
+        if self._rescale is not None and self._use_cache:
+            key = rescale_cache.key(self._path, self._rescale, 3)
+            data = rescale_cache.get(key)
+            
+            if data is not None:
+                return data
+        
+        # convert to float: this is the only full copy of the raw data
+        bscale, bzero = self._scale
+        data = self._raw.astype(np.float64)
+        if bscale != 1: data *= bscale
+        if bzero != 0:  data += bzero
+        
+        # fix bad pixels: set to max
+        # ~ data[data<self.header['BZERO']] = np.max(data)
+        data[data<self.header['BZERO']] += np.max(data) + 1
+        
+        # rescale image: slow 3rd order spline
+        if self._rescale is not None:
+            data = rescale(data, self._rescale, order=3, preserve_range=True) 
+            
+            if self._use_cache:
+                rescale_cache.put(key, data)
+        
+        return data
+        
+    # ======================================================================= #
+    def _make_data(self):
+        """
+            Apply black, white, and mask to data_original
+            
+            returns: masked array
+        """
+        
+        data = self.data_original
+        
+        # reset black and white, only copy if values need clipping
+        lo, hi = self.get_range()
+        if lo < self.black or hi > self.white:
+            data = np.clip(data, self.black, self.white)
+        
+        # masking
+        return np.ma.array(data, mask=self._get_window(), copy=False)
+        
+    # ======================================================================= #
+    def _get_window(self):
+        """
+            Get boolean array which is True outside of the mask circle, or 
+            np.ma.nomask if there is no mask
+        """
+        
+        if self._window is None:
+            mask = self.mask
+            
+            if mask is None:
+                self._window = np.ma.nomask
+            else:
+                shape = self.data_original.shape
+                window = np.ones(shape, dtype=bool)
+                rr, cc = ski.draw.disk((mask[1], mask[0]), mask[2], shape=shape)
+                window[rr, cc] = False
+                self._window = window
+                
+        return self._window
+        
+    # ======================================================================= #
+    def _get_derived(self, key, fn):
+        """
+            Get derived product from the cache, or compute and save it. 
+            
+            key:    tuple, first element is the product name
+            fn:     function with no inputs which computes the product
+        """
+        
+        if key in self._derived:
+            self.derived_hits += 1
+            return self._derived[key]
+        
+        self.derived_misses += 1
+        value = fn()
+        self._derived[key] = value
+        return value
+        
+    # ======================================================================= #
+    def _get_display(self):
+        """Get data_original with the mask, without black and white applied"""
+        if self._display is None:
+            self._display = np.ma.array(self.data_original, 
+                                        mask=self._get_window(), 
+                                        copy=False)
+        return self._display
+        
+    # ======================================================================= #
+    def _get_edges(self, sigma, fill=True):
+        """
+            Get canny edges of the data
+            
+            sigma:  standard deviation of the gaussian filter
+            fill:   if True, set masked pixels to black before finding edges
+        """
+        
+        def calc():
+            data = self._get_filled() if fill else self.data
+            return canny(data, sigma=sigma, low_threshold=0, high_threshold=1)
+            
+        return self._get_derived(('edges', sigma, fill), calc)
+        
+    # ======================================================================= #
+    def _get_filled(self):
+        """Get data with masked pixels set to black, as a numpy array"""
+        return self._get_derived(('filled', ), 
+                                 lambda : np.ma.filled(self.data, self.black))
+    
+    # ======================================================================= #
+    def _get_grid(self):
+        """Get meshgrid of pixel coordinates (X, Y)"""
+        return self._get_derived(('grid', ), lambda : 
+                    np.meshgrid(*tuple(map(np.arange, self.data_original.shape[::-1]))))
+        
+    # ======================================================================= #
+    def _get_moments(self, nthresh=3, nsigma=4):
+        """
+            Background-subtracted image moments, see get_moments
+            
+            returns: dict with keys x0, y0, sigmax, sigmay, theta (gaussian2D 
+                     convention), stdx, stdy (standard deviations along x and 
+                     y), amp, err_x0, err_y0. Values are nan if there is no 
+                     beam: the pixels above the threshold exceed those below 
+                     it by less than five standard deviations (ex: a dark 
+                     frame)
+        """
+        
+        data = self.data
+        
+        # background and noise from subsample, excluding masked pixels
+        sub = np.ma.filled(data[::4, ::4].astype(np.float64), np.nan)
+        bkg = np.nanmedian(sub)
+        noise = 1.4826*np.nanmedian(np.abs(sub-bkg))
+        
+        # masked pixels have no weight
+        weight = np.ma.filled(data, bkg) - bkg
+        peak = np.max(weight)
+        
+        def moments(w, ylo, xlo):
+            y = np.arange(ylo, ylo+w.shape[0])
+            x = np.arange(xlo, xlo+w.shape[1])
+            
+            # projections: only the cross term needs the full image
+            wx = w.sum(axis=0)
+            wy = w.sum(axis=1)
+            total = wx.sum()
+            
+            x0 = np.dot(wx, x)/total
+            y0 = np.dot(wy, y)/total
+            cxx = np.dot(wx, np.square(x-x0))/total
+            cyy = np.dot(wy, np.square(y-y0))/total
+            cxy = np.dot(np.dot(y-y0, w), x-x0)/total
+            neff = total**2/np.sum(np.square(w))
+            return (x0, y0, cxx, cyy, cxy, total, neff)
+        
+        # first pass: whole image, thresholded to remove the noise floor
+        w = weight*(weight > nthresh*noise)
+        
+        # noise is as likely below the background as above it: compare the 
+        # sums of the pixels past the threshold on either side
+        below = weight*(weight < -nthresh*noise)
+        excess = np.sum(w) + np.sum(below)
+        err = np.sqrt(np.sum(np.square(w)) + np.sum(np.square(below)))
+        
+        # no beam: blank or constant image, or no more signal above the 
+        # threshold than the noise gives (ex: a dark frame)
+        if not excess > 5*err:
+            return {k: np.nan for k in ('x0', 'y0', 'sigmax', 'sigmay', 
+                    'theta', 'stdx', 'stdy', 'amp', 'err_x0', 'err_y0')}
+        
+        x0, y0, cxx, cyy, cxy, total, neff = moments(w, 0, 0)
+        
+        # second pass: unthresholded within nsigma of the first estimate
+        ylo, yhi, xlo, xhi = self.get_roi(nsigma, 
+                                    center=(x0, y0, np.sqrt(cxx), np.sqrt(cyy)))
+        window = moments(weight[ylo:yhi, xlo:xhi], ylo, xlo)
+        
+        # keep if noise did not make it unphysical
+        if window[5] > 0 and window[2] > 0 and window[3] > 0 and \
+           window[2]*window[3] > window[4]**2:
+            x0, y0, cxx, cyy, cxy, total, neff = window
+        
+        # principal axes: gaussian2D rotates sigmax by -theta
+        half = 0.5*(cxx+cyy)
+        r = np.sqrt(0.25*np.square(cxx-cyy) + np.square(cxy))
+        sigmax = np.sqrt(half+r)
+        sigmay = np.sqrt(max(half-r, 0))
+        theta = 0.5*np.arctan2(-2*cxy, cxx-cyy)
+        
+        return {'x0':       x0, 
+                'y0':       y0, 
+                'sigmax':   sigmax, 
+                'sigmay':   sigmay, 
+                'theta':    theta, 
+                'stdx':     np.sqrt(cxx), 
+                'stdy':     np.sqrt(cyy), 
+                'amp':      total/(2*np.pi*sigmax*sigmay)/peak, 
+                'err_x0':   np.sqrt(cxx/neff), 
+                'err_y0':   np.sqrt(cyy/neff), 
+                }
+        
+    # ======================================================================= #
+    def _invalidate(self, mask=False):
+        """
+            Data has changed: clear the derived products which depend on the 
+            black, white, or mask settings
             
+            mask:   if True, the mask changed, else only black or white
+        """
+        keep = self.static_products
+        if not mask:
+            keep = keep + self.mask_products
+        
+        self._data = None
+        self._derived = {k:v for k, v in self._derived.items() if k[0] in keep}
+        
     # ======================================================================= #
     def detect_lines(self, sigma=1, min_length=50, min_gap=3, theta=None, nlines=np.inf, 
                      draw=True):
@@ -101,7 +414,7 @@ class fits(object):
         data = self.data
         
         # get edges
-        edges = canny(data, sigma=sigma, low_threshold=0, high_threshold=1)
+        edges = self._get_edges(sigma, fill=False)
         
         # select lines
         lines = probabilistic_hough_line(edges, threshold=10, line_length=min_length, 
@@ -160,11 +473,10 @@ class fits(object):
         """
         
         # get raw data
-        data = np.copy(self.data)
-        data[self.data.mask] = self.black
+        data = self._get_filled()
         
         # get edges
-        edges = canny(data, sigma=sigma, low_threshold=0, high_threshold=1)
+        edges = self._get_edges(sigma)
         
         # get radii
         hough_radii = np.arange(*rad_range, 2)
@@ -176,6 +488,7 @@ class fits(object):
         
         # draw
         if draw:
+            from matplotlib.patches import Circle
             
             self.plt.imshow(self.filename, data, alpha=1, cmap='Greys_r', **self.show_options)
             edges = np.ma.masked_where(~edges, edges.astype(int))
@@ -192,7 +505,8 @@ class fits(object):
         return (cx, cy, radii)
     
     # ======================================================================= #
-    def draw(self, black=None, white=None, alpha=1, cmap='Greys', imap=True):
+    def draw(self, black=None, white=None, alpha=1, cmap='Greys', imap=True, 
+             replace=None):
         """
             Draw fits file to matplotlib figure
             
@@ -201,6 +515,8 @@ class fits(object):
             alpha:      draw transparency
             cmap:       colormap
             imap:       invert the colour map
+            replace:    filename of a drawn image to replace, updating it in 
+                        place if possible (ex: next image from the camera)
         """
         
         # get raw data
@@ -208,42 +524,41 @@ class fits(object):
             self.set_black(black)
         if white is not None:
             self.set_white(white)
-        data = self.data
+        
+        # unclipped data: black and white are applied as the colour limits
+        display = self._get_display()
+        vmin, vmax = self.get_levels()
         
         # color map 
         if imap: cmap+='_r'
         
         # draw 
-        self.plt.imshow(self.filename, data, alpha=alpha, cmap=cmap,
+        self.plt.imshow(self.filename, display, alpha=alpha, cmap=cmap,
+                        vmin=vmin, vmax=vmax, 
                         info = {'style':'Greyscale', 
                                 'black':self.black, 
                                 'white':self.white, 
                                 'exposure_s':self.header['EXPOSURE'], 
                                 'date':self.datetime
                                },
+                        replace=replace, 
                         **self.show_options)
     
     # ======================================================================= #    
-    def draw_2Dfit(self, fn, *pars, levels=10, cmap='jet'):
+    def draw_2Dfit(self, fn, *pars, levels=10, cmap='jet', **kwargs):
         """
             Draw the fit function as contours
-        
+            
+            kwargs: passed to contour (ex: alpha)
         """
         
-        # get image shape
-        shape = self.data.shape
-        
         # get function image
-        x = np.arange(shape[1])    
-        y = np.arange(shape[0])    
-        gauss = np.zeros((len(y), len(x)))
-        for i in y:
-            gauss[i-y[0], :] = fn(x, i, *pars)
+        X, Y = self._get_grid()
+        gauss = fn(X, Y, *pars)
 
         # draw image
-        X, Y = np.meshgrid(x, y)
         ax = self.plt.gca()
-        contours = ax.contour(X, Y, gauss, levels=levels, cmap=cmap)
+        contours = ax.contour(X, Y, gauss, levels=levels, cmap=cmap, **kwargs)
         ax.clabel(contours, inline=True, fontsize='x-small', fmt='%g')
         
         self.contours = contours
@@ -266,7 +581,7 @@ class fits(object):
         if imap: cmap+='_r'
         
         # draw
-        X, Y = np.meshgrid(*tuple(map(np.arange, data.shape[::-1])))
+        X, Y = self._get_grid()
         ax = self.plt.gca()
         
         options = {k:val for k, val in self.show_options.items() if k != "interpolation"}
@@ -290,21 +605,17 @@ class fits(object):
             imap:       invert the colour map
         """
         
-        # get raw data
-        data = self.data
-        
-        # get edges
-        data2 = np.copy(data)
-        data2[data.mask] = self.black
-        edges = canny(data2, sigma=sigma, low_threshold=0, high_threshold=1)
+        # get edges, as image with non-edges masked
+        def calc():
+            edges = self._get_edges(sigma)
+            return np.ma.masked_where(~edges, edges.astype(int))
+        edges = self._get_derived(('edges_image', sigma), calc)
         
         # color map
         if imap: cmap += '_r'
         
         # draw
-        edges = np.ma.masked_where(~edges, edges.astype(int))
-        
-        self.plt.imshow(filename, edges, alpha=alpha, cmap=cmap, 
+        self.plt.imshow(self.filename, edges, alpha=alpha, cmap=cmap, 
                         info = {'style':'Edges', 
                                 'black':self.black, 
                                 'white':self.white, 
@@ -326,11 +637,14 @@ class fits(object):
         # color map
         if imap: cmap += '_r'
         
-        # draw
-        data = np.copy(self.data)
-        sbl = filters.sobel(data)
-        sbl[self.data.mask]=0
+        # get gradient
+        def calc():
+            sbl = filters.sobel(np.ma.getdata(self.data))
+            sbl[np.ma.getmaskarray(self.data)] = 0
+            return sbl
+        sbl = self._get_derived(('sobel', ), calc)
         
+        # draw
         self.plt.imshow(self.filename,
                         sbl, 
                         alpha=alpha, 
@@ -345,20 +659,33 @@ class fits(object):
         return sbl
         
     # ======================================================================= #
-    def fit2D(self, function, pix_error=1, **fitargs):
+    def fit2D(self, function, pix_error=1, jac=None, roi=None, **fitargs):
         """
             Fit general function to fits file
             
-            function:   python function handle
+            function:   python function handle, function(x, y, *pars). x and y 
+                        are passed as open grids (shapes (1, n) and (m, 1)) 
+                        so the function should broadcast them
             pix_error:  estimation for the error in the pixel values
+            jac:        python function handle, jacobian of function with the 
+                        same inputs, returning an array of shape (m, n, npars). 
+                        If None, use finite differences
+            roi:        (ylo, yhi, xlo, xhi) pixel bounds of the region to fit. 
+                        If None, find with get_roi. Fit parameters are always 
+                        in the coordinates of the full image
             returns curve_fit output
         """
         
-        # get data and trim the edges
-        data = self.data[:300, :200]
+        # get region of interest (a view of the data)
+        if roi is None:
+            roi = self.get_roi()
+        ylo, yhi, xlo, xhi = roi
+        data = self.data[ylo:yhi, xlo:xhi]
+        self.roi = roi
+        self.nfev = 0
         
-        # flatten the image
-        flat = np.ravel(data)
+        # flatten the image: copy, don't modify the data
+        flat = np.ravel(data).astype(np.float64)
         
         # get number of fit parameters (first two are x, y)
         npar = function.__code__.co_argcount-2
@@ -369,67 +696,109 @@ class fits(object):
         zero = np.min(flat)
         flat -= zero
         
-        # normalize
-        flat /= np.max(flat)
+        # normalize: a constant image has no beam to fit
+        norm = np.max(flat)
+        if not norm > 0:
+            raise RuntimeError('No beam found')
+        flat /= norm
+        
+        # pixel coordinates in the full image
+        y, x = np.ogrid[ylo:yhi, xlo:xhi]
         
         # flatten the funtion 
-        def fitfn(xy, *pars):    
-            output = function(*xy, *pars)
-            return np.ravel(output)
+        def fitfn(_, *pars):    
+            output = function(x, y, *pars)
+            return np.ravel(np.broadcast_to(output, data.shape))
+        
+        # flatten the jacobian
+        if jac is not None:
+            def fitjac(_, *pars):
+                return np.reshape(jac(x, y, *pars), (flat.size, npar))
+            fitargs['jac'] = fitjac
         
         # fit
-        x = np.indices(data.shape)[::-1]
-        par, cov = curve_fit(fitfn, x, flat, **fitargs)
+        idx = np.arange(flat.size)
+        par, cov, info, _, _ = curve_fit(fitfn, idx, flat, full_output=True, **fitargs)
         
         self.result_fit2D = (par, cov)
+        self.nfev = info['nfev']
         
         # get chisquared
-        self.chi2 = np.sum(np.square( (flat-fitfn(x, *par))/pix_error )) / (len(flat)-npar)
+        self.chi2 = np.sum(np.square( (flat-fitfn(idx, *par))/pix_error )) / (len(flat)-npar)
         
         return (par, cov)
     
     # ======================================================================= #    
-    def fit_gaussian2D(self, draw=True, get_p0_from_center=False, pix_error=1, **fitargs):
+    def fit_gaussian2D(self, draw=True, get_p0_from_center=False, pix_error=1, 
+                       nsigma=4, p0=None, fit_kwargs=None, **drawargs):
         """
-            Fit 2D gaussian to image
+            Fit 2D gaussian to image, within nsigma of the beam center
             
             draw:               draw the output
-            get_p0_from_center: use get_center to estimate some of the p0 parameters
+            get_p0_from_center: use get_center to estimate some of the p0 
+                                parameters and the region of interest, 
+                                else use get_moments
+            nsigma:             size of fitting region, in standard deviations
+            p0:                 (x0, y0, sigmax, sigmay, amp, theta) starting 
+                                parameters, which also set the region of 
+                                interest (ex: from a previous frame). If None, 
+                                estimate from the image
+            fit_kwargs:         dict, passed to fit2D and curve_fit. Ex: 
+                                {'tr_solver': 'lsmr'} is faster for large 
+                                regions of interest
+            drawargs:           passed to draw_2Dfit (ex: levels, cmap, alpha)
         """
         
         # get data 
         data = self.data
         
-        # estimate moments https://scipy-cookbook.readthedocs.io/items/FittingData.html
-        total = data.sum()
-        X, Y = np.indices(data.shape)
-        
-        if get_p0_from_center:
+        # estimate starting parameters and region of interest
+        if p0 is not None:
+            x, y, width_x, width_y, amp, theta = p0
+            ct = np.cos(theta)
+            st = np.sin(theta)
+            center = (x, y, np.hypot(ct*width_x, st*width_y), 
+                            np.hypot(st*width_x, ct*width_y))
+            
+        elif get_p0_from_center:
             x, y, width_x, width_y = self.get_center(draw = False)
+            amp = 1
+            theta = 0
+            center = (x, y, width_x*np.sqrt(2), width_y*np.sqrt(2))
             
         else:
-            x = (X*data).sum()/total
-            y = (Y*data).sum()/total
-            col = data[:, int(y)]
-            width_x = np.sqrt(np.abs((np.arange(col.size)-y)**2*col).sum()/col.sum())
-            row = data[int(x), :]
-            width_y = np.sqrt(np.abs((np.arange(row.size)-x)**2*row).sum()/row.sum()) 
+            mom = self._get_moments()
+            if np.isnan(mom['x0']):
+                raise RuntimeError('No beam found')
+            x, y, width_x, width_y, theta = [mom[k] for k in 
+                                        ('x0', 'y0', 'sigmax', 'sigmay', 'theta')]
+            amp = 1
+            center = (x, y, mom['stdx'], mom['stdy'])
+            
+        ylo, yhi, xlo, xhi = roi = self.get_roi(nsigma, center=center)
+        
+        # bounds: center within the region of interest
+        smax = max(data.shape)
+        lo = np.array([xlo, ylo, 0, 0, 0, -np.inf])
+        hi = np.array([xhi, yhi, smax, smax, np.inf, np.inf])
         
         # fit 
-        p0 = (x, y, width_x, width_y, 1, 0)        
-        par, cov = self.fit2D(gaussian2D, p0=p0, 
-                                bounds=[[0, 0, 0, 0, 0, -np.inf], \
-                                        [500, 500, 500, 500, np.inf, np.inf]])
+        p0 = np.clip((x, y, width_x, width_y, amp, theta), lo+1e-3, hi-1e-3)
+        if fit_kwargs is None:
+            fit_kwargs = {}
+        par, cov = self.fit2D(gaussian2D, pix_error=pix_error, jac=gaussian2D_jac, 
+                              p0=p0, roi=roi, bounds=[lo, hi], **fit_kwargs)
         std = np.diag(cov)**0.5
         
         # make output
+        import pandas as pd
         df = pd.DataFrame({"result":par, "error":std}, 
                             index=('x0', 'y0', 'sigmax', 'sigmay', 'amp', 'theta'))
         
         # draw output
         if draw:
             self.draw()
-            contours = self.draw_2Dfit(gaussian2D, *par[:4], 1, 0, **fitargs)
+            contours = self.draw_2Dfit(gaussian2D, *par[:4], 1, par[5], **drawargs)
             
             self.plt.xlim((par[0]-4*par[2], par[0]+4*par[2]))
             self.plt.ylim((par[1]-4*par[3], par[1]+4*par[3]))
@@ -560,8 +929,8 @@ class fits(object):
             
             ylo:    lower integration bound [outer] (float)
             yhi:    upper integration bound [outer] (float)
-            xlo:    lower integration bound [inner] (lambda function)
-            xlhi:   upper integration bound [inner] (lambda function)
+            xlo:    lower integration bound [inner] (lambda function or float)
+            xhi:    upper integration bound [inner] (lambda function or float)
             
                 integration is: 
                     
@@ -570,76 +939,219 @@ class fits(object):
             
             par:    parameter list x0, y0, sx, sy, amp, theta. If none, get from self
             
-            returns overlap as given by dblquad
+            returns overlap as given by overlap.region. For many circles, 
+            ellipses, or rectangles use the functions in bccd.backend.overlap 
+            directly.
         """
         
         # get fitting results 
         if par is None:
-            x0, y0, sx, sy, amp, theta = self.result_gaussian2D['result']
-        else:
-            x0, y0, sx, sy, amp, theta = par
+            par = self.result_gaussian2D['result']
             
-        # get normalized volume
-        # https://en.wikipedia.org/wiki/Gaussian_function
-        # ~ a = 0.5*(np.cos(theta)/sx)**2 + 0.5*(np.sin(theta)/sy)**2
-        # ~ b = 0.25*-(np.sin(theta)/sx)**2 + 0.25*(np.sin(theta)/sy)**2
-        # ~ c = 0.5*(np.sin(theta)/sx)**2 + 0.5*(np.cos(theta)/sy)**2
-        # ~ amp = np.sqrt(a*c-b**2)/np.pi
+        # integrate: fraction of beam overlap
+        result = overlap.region(par, ylo, yhi, xlo, xhi)
         
-        amp = 1/(2*np.pi*sx*sy)
+        self.result_gaussian2D_overlap = result
+        return result
         
-        # make PDF
-        gaus = lambda x, y: gaussian2D(x, y, x0, y0, sx, sy, amp, theta)
+    # ======================================================================= #
+    def get_levels(self):
+        """
+            Get the colour limits which correspond to the black and white 
+            levels: the same as autoscaling the clipped and masked data.
+            
+            returns: (vmin, vmax)
+        """
         
-        # integrate: fraction of beam overlap
-        overlap =  dblquad(gaus, ylo, yhi, xlo, xhi)[0]
+        # range of the unmasked pixels
+        def calc():
+            display = self._get_display()
+            if display.mask is np.ma.nomask or display.mask.all():
+                return self.get_range()
+            return (float(np.ma.min(display)), float(np.ma.max(display)))
+        
+        lo, hi = self._get_derived(('display_range', ), calc)
+        return (float(max(lo, self.black)), float(min(hi, self.white)))
+        
+    # ======================================================================= #
+    def get_memory_blocks(self):
+        """
+            Get the blocks of memory held by pixel arrays, including masks and 
+            derived products. Use to count memory shared between fits objects 
+            once. 
+            
+            returns: dict, {id: bytes}
+        """
+        
+        arrays = [self._data_original, self._window]
+        for value in (self._data, self._display):
+            if value is not None:
+                arrays.extend((np.ma.getdata(value), np.ma.getmask(value)))
+        for value in self._derived.values():
+            if isinstance(value, (tuple, list)):
+                arrays.extend(value)
+            else:
+                arrays.append(value)
+        
+        # count each block of memory once: views share their base, and 
+        # memory maps are based on an mmap
+        blocks = {}
+        for a in arrays:
+            if not isinstance(a, np.ndarray):
+                continue
+            while isinstance(a.base, np.ndarray):
+                a = a.base
+            if a.base is None:
+                blocks[id(a)] = a.nbytes
+        
+        return blocks
+        
+    # ======================================================================= #
+    def get_moments(self, draw=True, nthresh=3, nsigma=4):
+        """
+            Estimate beam center, widths, and rotation from the second moments
+            of the background-subtracted image. Much faster than 
+            fit_gaussian2D, and used to seed it. 
+            
+            The background and noise are the median and median absolute 
+            deviation of the image. Moments are first calculated from pixels 
+            more than nthresh noise above background, then refined using all 
+            pixels within nsigma standard deviations. Masked pixels are excluded. 
+            
+            draw:       if true, draw the output
+            nthresh:    threshold for first estimate, in units of the noise
+            nsigma:     size of the region for the second estimate, in standard 
+                        deviations
+            
+            returns:    DataFrame, same format as fit_gaussian2D. amp is 
+                        relative to the peak height. Errors are statistical 
+                        estimates for x0 and y0, and nan otherwise. All 
+                        values are nan if the pixels above the threshold 
+                        could be noise: their sum is not significantly more 
+                        than that of the pixels as far below the background.
+        """
+        
+        mom = self._get_moments(nthresh=nthresh, nsigma=nsigma)
+        
+        names = ('x0', 'y0', 'sigmax', 'sigmay', 'amp', 'theta')
+        par = [mom[k] for k in names]
+        std = [mom['err_x0'], mom['err_y0'], np.nan, np.nan, np.nan, np.nan]
         
-        self.result_gaussian2D_overlap = overlap
-        return overlap
+        import pandas as pd
+        df = pd.DataFrame({"result":par, "error":std}, index=names)
+        
+        # draw output
+        if draw:
+            self.draw()
+            
+            if not np.isnan(par[0]):
+                self.draw_2Dfit(gaussian2D, *par[:4], 1, par[5])
+                self.plt.xlim((par[0]-4*par[2], par[0]+4*par[2]))
+                self.plt.ylim((par[1]-4*par[3], par[1]+4*par[3]))
+        
+        self.result_moments = df
+        return df
+        
+    # ======================================================================= #
+    def get_range(self):
+        """
+            Get the minimum and maximum pixel values of data_original
+            
+            returns: (min, max)
+        """
+        if self._range is None:
+            data = self.data_original
+            self._range = (float(np.min(data)), float(np.max(data)))
+        return self._range
+        
+    # ======================================================================= #
+    def get_roi(self, nsigma=4, center=None):
+        """
+            Get region of interest around the beam spot
+            
+            nsigma:     half-width of region, in standard deviations
+            center:     (x0, y0, stdx, stdy), beam center and standard 
+                        deviations along x and y. If None, find with get_center
+            
+            returns:    (ylo, yhi, xlo, xhi) pixel bounds, clipped to the image
+        """
+        
+        # get_center widths are sqrt(2) times smaller than standard deviations
+        if center is None:
+            x0, y0, sigx, sigy = self.get_center(draw=False)
+            center = (x0, y0, sigx*np.sqrt(2), sigy*np.sqrt(2))
+        x0, y0, stdx, stdy = center
+        
+        dx = nsigma*stdx
+        dy = nsigma*stdy
+        
+        ny, nx = self.data_original.shape
+        
+        ylo = int(np.clip(np.floor(y0-dy), 0, ny-1))
+        yhi = int(np.clip(np.ceil(y0+dy)+1, ylo+1, ny))
+        xlo = int(np.clip(np.floor(x0-dx), 0, nx-1))
+        xhi = int(np.clip(np.ceil(x0+dx)+1, xlo+1, nx))
+        
+        return (ylo, yhi, xlo, xhi)
         
     # ======================================================================= #
-    def read(self, filename, rescale_pixels=True):
+    def read(self, filename, rescale_pixels=True, use_cache=True):
         """
             Get xy data from fits file. Values are brightness of pixel. 
             
             filename:       name of file to open
             rescale_pixels: if True, rescale image such that pixels are square
+            use_cache:      if True, fetch rescaled image from the on-disk cache
+                            (see rescale_cache), saving it there on a miss
         """
         
         # open the file
         filename = os.path.join(os.getcwd(), filename)
-        fid = astrofits.open(filename)[0]
+        header, offset = read_header(filename, return_size=True)
         
-        # read the header
-        self.header = fid.header
+        # memory-map the pixels: no reading or copying until needed
+        if is_simple_image(header):
+            self._raw = memmap_data(filename, header, offset)
+            self._scale = (header.get('BSCALE', 1), header.get('BZERO', 0))
         
-        # get the data
-        data = fid.data
-
-        # fix bad pixels: set to max
-        # ~ data[data<self.header['BZERO']] = np.max(data)
-        data = data.astype(np.float64)
-        data[data<self.header['BZERO']] += np.max(data) + 1
+        # other formats: astropy applies the scaling
+        else:
+            from astropy.io import fits as astrofits
+            fid = astrofits.open(filename)[0]
+            header = fid.header
+            self._raw = fid.data
+            self._scale = (1, 0)
+        
+        # read the header
+        self.header = header
         self.black = self.header['BZERO']
         self.white = np.inf
         
-        # rescale image to correct pixel size asymmetry
+        # rescale factors to correct pixel size asymmetry
         if rescale_pixels:
             aspect = self.header['YPIXSZ']/self.header['XPIXSZ']
             
             # always enlarge image, never make it smaller
-            if aspect > 1:      resc = (aspect, 1)
-            else:               resc = (1, 1/aspect)
-            
-            data = rescale(data, resc, order=3, preserve_range=True) 
-        
-        self.data = data
+            if aspect > 1:      self._rescale = (aspect, 1)
+            else:               self._rescale = (1, 1/aspect)
+        else:
+            self._rescale = None
+        
+        # data is converted on first access
+        self._path = filename
+        self._use_cache = use_cache
+        self._data_original = None
+        self._data = None
+        self._display = None
+        self._range = None
+        self._window = None
+        self.mask = None
+        self._derived = {}
+        self.derived_hits = 0
+        self.derived_misses = 0
         
         # get the time and date
-        date = self.header['DATE-OBS']
-        utc = datetime.strptime(date, '%Y-%m-%dT%H:%M:%S')
-        utc = utc.replace(tzinfo=tz.tzutc())
-        self.datetime = utc.astimezone(tz=None)
+        self.datetime = get_datetime(self.header)
         
     # ======================================================================= #
     def set_black(self, black):
@@ -650,11 +1162,10 @@ class fits(object):
                     this level
         """
         
-        # set the black input
-        self.black = black
-        
-        # apply black input and mask settings
-        self.set_mask(self.mask)
+        # set the black input, data is regenerated on next access
+        if black != self.black:
+            self.black = black
+            self._invalidate()
         
     # ======================================================================= #
     def set_white(self, white):
@@ -665,11 +1176,10 @@ class fits(object):
                     this level
         """
         
-        # set the black input
-        self.white = white
-        
-        # apply black input and mask settings
-        self.set_mask(self.mask)
+        # set the white input, data is regenerated on next access
+        if white != self.white:
+            self.white = white
+            self._invalidate()
         
     # ======================================================================= #
     def set_mask(self, mask):
@@ -678,24 +1188,28 @@ class fits(object):
             mask:       (x, y, r) specifying center and radius of circle to mask on
         """
         
-        # set the mask input
+        # set the mask input, data is regenerated on next access
+        if mask == self.mask:
+            return
         self.mask = mask
+        self._display = None
+        self._window = None
+        self._invalidate(mask=True)
         
-        # reset black and white
-        data = np.copy(self.data_original)
-        data[data<self.black] = self.black
-        data[data>self.white] = self.white
-        
-        # masking
-        if mask is not None:     
-            window = np.ones(self.data.shape)
-            rr, cc = ski.draw.disk((mask[1], mask[0]), mask[2], shape=data.shape)
-            window[rr, cc] = 0
-            data = np.ma.array(data, mask=window)
-        
-        # make as a masked array
-        else:
-            data = np.ma.asarray(data)
-        
-        self.data = data
-        
+    # ======================================================================= #
+    def unload(self):
+        """
+            Free the pixel arrays, keeping the header and settings. The pixels 
+            are read again from the rescale cache or the memory-mapped file 
+            on next access. Pixels shared with other fits objects are freed 
+            when none of them use them. 
+            
+            returns: bytes no longer held by this object
+        """
+        nbytes = self.nbytes
+        self._data_original = None
+        self._data = None
+        self._display = None
+        self._window = None
+        self._derived = {}
+        return nbytes
@@ -5,18 +5,70 @@
 import numpy as np
 
 def gaussian2D(x, y, x0, y0, sigmax, sigmay, amp, theta=0):
-    """Gaussian in 2D - from wikipedia"""
-    
+    """
+        Gaussian in 2D - from wikipedia
+
+        x and y may be open grids (ex: x with shape (1, n) and y with shape
+        (m, 1)), in which case the output is broadcast to shape (m, n). If
+        theta is zero the exponential is then only evaluated on the axes.
+    """
+
+    # separable: no cross term
+    if theta == 0:
+        return amp*np.exp(-0.5*np.square((x-x0)/sigmax)) * \
+                   np.exp(-0.5*np.square((y-y0)/sigmay))
+
     ct2 = np.cos(theta)**2
     st2 = np.sin(theta)**2
     s2t = np.sin(2*theta)
-    
+
     sx = sigmax**2
     sy = sigmay**2
-    
+
     a = 0.5*(ct2/sx + st2/sy)
     b = 0.25*s2t*(-1/sx + 1/sy)
     c = 0.5*(st2/sx + ct2/sy)
-    
+
     return amp*np.exp(-(a*np.square(x-x0) + 2*b*(x-x0)*(y-y0) + c*np.square(y-y0)))
 
+def gaussian2D_jac(x, y, x0, y0, sigmax, sigmay, amp, theta=0):
+    """
+        Jacobian of gaussian2D with respect to (x0, y0, sigmax, sigmay, amp,
+        theta).
+
+        returns array with shape of the broadcast x and y, plus a last axis
+        of length 6 for the parameters
+    """
+
+    ct = np.cos(theta)
+    st = np.sin(theta)
+
+    sx = sigmax**2
+    sy = sigmay**2
+
+    # coordinates along the gaussian axes: exponent is -u^2/2sx - v^2/2sy
+    # for theta = 0 these stay open grids
+    if theta == 0:
+        u = x-x0
+        v = y-y0
+    else:
+        u = ct*(x-x0) - st*(y-y0)
+        v = st*(x-x0) + ct*(y-y0)
+
+    pu = u/sx
+    pv = v/sy
+
+    expo = np.exp(-0.5*u*pu) * np.exp(-0.5*v*pv)
+    G = amp*expo
+
+    # parameter axis first in memory, so each derivative is contiguous
+    shape = np.broadcast(x, y).shape
+    jac = np.empty((6, ) + shape)
+    jac[0] = G*(ct*pu + st*pv)
+    jac[1] = G*(ct*pv - st*pu)
+    jac[2] = G*u*pu/sigmax
+    jac[3] = G*v*pv/sigmay
+    jac[4] = expo
+    jac[5] = G*(v*pu - u*pv)
+
+    return np.moveaxis(jac, 0, -1)
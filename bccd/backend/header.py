@@ -0,0 +1,145 @@
+# Fast readers for simple fits files: header only and memory-mapped pixels
+# Derek Fujimoto
+# Oct 2026
+
+import re
+import numpy as np
+from datetime import datetime
+from dateutil import tz
+
+# fits files are organized in blocks of 36 cards, 80 characters each
+block_size = 2880
+card_size = 80
+
+# big-endian data type for each BITPIX value
+bitpix_dtype = {8:   np.dtype('u1'), 
+                16:  np.dtype('>i2'), 
+                32:  np.dtype('>i4'), 
+                64:  np.dtype('>i8'), 
+                -32: np.dtype('>f4'), 
+                -64: np.dtype('>f8')}
+
+# match a number in fortran or python format
+_number = re.compile(r'^[+-]?(\d+\.?\d*|\.\d+)([eEdD][+-]?\d+)?$')
+
+# =========================================================================== #
+def _parse_value(value):
+    """
+        Convert the value field of a header card to a python type
+
+        value: string, everything after "= " in the card
+    """
+
+    value = value.strip()
+
+    # string: quotes are escaped by doubling them
+    if value.startswith("'"):
+        i = 1
+        while True:
+            i = value.find("'", i)
+            if i < 0 or value[i+1:i+2] != "'":
+                break
+            i += 2
+        return value[1:i].replace("''", "'").rstrip()
+
+    # remove comment
+    value = value.split('/', 1)[0].strip()
+
+    if value == 'T':    return True
+    if value == 'F':    return False
+    if value == '':     return None
+
+    try:
+        return int(value)
+    except ValueError:
+        pass
+
+    if _number.match(value):
+        return float(value.replace('D', 'E').replace('d', 'e'))
+
+    return value
+
+# =========================================================================== #
+def get_datetime(header):
+    """
+        Get the time the image was taken, in the local time zone
+
+        header:     dict-like, with key DATE-OBS in UTC
+        returns:    datetime object
+    """
+    date = header['DATE-OBS']
+    utc = datetime.strptime(date, '%Y-%m-%dT%H:%M:%S')
+    utc = utc.replace(tzinfo=tz.tzutc())
+    return utc.astimezone(tz=None)
+
+# =========================================================================== #
+def read_header(filename, return_size=False):
+    """
+        Read the primary header of a fits file, without reading any pixel data
+
+        filename:       name of file to open
+        return_size:    if True, also return the size of the header in bytes,
+                        which is the offset to the start of the primary data
+
+        returns: dict of {keyword: value}, (and header size if return_size)
+    """
+
+    header = {}
+    size = 0
+
+    with open(filename, 'rb') as fid:
+
+        while True:
+            block = fid.read(block_size)
+
+            if len(block) < block_size:
+                raise IOError('%s: no END card found in header' % filename)
+
+            size += block_size
+            block = block.decode('ascii', errors='replace')
+
+            for i in range(0, block_size, card_size):
+                card = block[i:i+card_size]
+                key = card[:8].rstrip()
+
+                if key == 'END':
+                    if return_size:
+                        return (header, size)
+                    return header
+
+                # only cards with values, skip COMMENT, HISTORY, etc
+                if card[8:10] == '= ':
+                    header[key] = _parse_value(card[10:])
+
+# =========================================================================== #
+def is_simple_image(header):
+    """
+        Check if the primary array can be memory-mapped with memmap_data
+
+        header: dict, as returned by read_header
+    """
+    return (header.get('SIMPLE', False) is True and
+            header.get('NAXIS', 0) == 2 and
+            header.get('BITPIX', 0) in bitpix_dtype and
+            not header.get('GROUPS', False))
+
+# =========================================================================== #
+def memmap_data(filename, header, offset):
+    """
+        Memory-map the primary array of a simple 2D fits image, without
+        copying or converting it. BSCALE and BZERO are not applied: physical
+        values are BZERO + BSCALE*data.
+
+        filename:   name of file to open
+        header:     dict, as returned by read_header
+        offset:     int, size of the header in bytes
+
+        returns:    read-only numpy memmap with shape (NAXIS2, NAXIS1)
+    """
+
+    if not is_simple_image(header):
+        raise IOError('%s: not a simple 2D image' % filename)
+
+    shape = (header['NAXIS2'], header['NAXIS1'])
+    return np.memmap(filename, dtype=bitpix_dtype[header['BITPIX']], mode='r',
+                     offset=offset, shape=shape)
@@ -0,0 +1,310 @@
+# Fraction of a 2D gaussian beam falling within target shapes
+# Derek Fujimoto
+# Oct 2026
+
+"""
+    All functions take the gaussian2D parameters par = (x0, y0, sigmax, sigmay,
+    amp, theta), and return the probability that an event drawn from the
+    normalized gaussian falls within the shape (amp is ignored).
+
+    Shape parameters may be arrays, which are broadcast against each other to
+    evaluate many shapes in one call. Angles are in radians, counter-clockwise
+    from the x axis.
+
+    Axis-aligned rectangles (in the frame of the gaussian) are calculated
+    exactly with erf. Other shapes are transformed to coordinates in which the
+    gaussian is circular, then integrated along rays from its center:
+
+        P = 1/2pi int (exp(-t1^2/2) - exp(-t2^2/2)) dphi
+
+    where the ray at angle phi enters the shape at radius t1 and exits at t2.
+"""
+
+import numpy as np
+from functools import lru_cache
+from scipy.integrate import quad
+from scipy.special import erf
+
+# default number of ray angles
+npts = 64
+
+# =========================================================================== #
+def _erf_interval(center, half, sigma):
+    """
+        Probability that a centered normal variable lies within
+        center +/- half
+    """
+    s = np.sqrt(2)*sigma
+    return 0.5*(erf((center+half)/s) - erf((center-half)/s))
+
+# =========================================================================== #
+@lru_cache()
+def _leggauss(n):
+    """
+        Gauss-Legendre nodes and weights on [0, 1]
+    """
+    nodes, weights = np.polynomial.legendre.leggauss(n)
+    return (0.5*(nodes+1), 0.5*weights)
+
+# =========================================================================== #
+def _local(par, x, y, h1, h2, angle):
+    """
+        Get the gaussian parameters in the frame of the gaussian, and the
+        target center and axis angle in that frame
+
+        returns: (sigmax, sigmay, uc, vc, psi), with target center (uc, vc)
+                 and the target's first axis at angle psi from the u axis
+    """
+
+    x0, y0, sigmax, sigmay, _, theta = par
+
+    ct = np.cos(theta)
+    st = np.sin(theta)
+
+    dx = np.asarray(x, dtype=float)-x0
+    dy = np.asarray(y, dtype=float)-y0
+
+    uc = ct*dx - st*dy
+    vc = st*dx + ct*dy
+    psi = np.asarray(angle, dtype=float) + theta
+
+    return (sigmax, sigmay, uc, vc, psi)
+
+# =========================================================================== #
+def _rays(par, x, y, h1, h2, angle, norm, npts):
+    """
+        Integrate along rays from the gaussian center through a shape, with 
+        norm either 2 (ellipse) or inf (parallelogram).
+        
+        In whitened coordinates p the shape is M(q + m), |q| <= 1, with
+        M = diag(1/sigmax, 1/sigmay) R(psi) diag(h1, h2). Rays are 
+        parametrized by their angle beta in q coordinates, where the shape is 
+        a unit circle or square centered on m: a ray q = s e hits it between 
+        s1 and s2, at whitened radius t = s|Me|. The change of variables has 
+        dphi/dbeta = det(M)/|Me|^2. 
+        
+        Ellipses not containing the center are integrated only over the 
+        angles they subtend, with a cosine substitution to remove the square 
+        root at the tangents. Squares are split at the corner angles, where 
+        the integrand has kinks. 
+    """
+    
+    sx, sy, uc, vc, psi = _local(par, x, y, h1, h2, angle)
+    
+    cp = np.cos(psi)
+    sp = np.sin(psi)
+    
+    # add axis for ray angles
+    shape = np.broadcast(uc, vc, cp, h1, h2).shape
+    expand = lambda a: np.broadcast_to(np.asarray(a, dtype=float), shape)[..., None]
+    uc, vc, cp, sp, h1, h2 = map(expand, (uc, vc, cp, sp, h1, h2))
+    
+    # shape center in q coordinates
+    m1 = -(cp*uc + sp*vc)/h1
+    m2 = -(-sp*uc + cp*vc)/h2
+    
+    # ray angles and quadrature weights
+    if norm == 2:
+        nodes, weights = _leggauss(npts)
+        r = np.sqrt(m1*m1 + m2*m2)
+        inside = r <= 1
+        
+        # subtended angles if outside
+        center = np.arctan2(m2, m1)
+        half = np.arcsin(1/np.maximum(r, 1))
+        cosine = np.cos(np.pi*nodes)
+        beta_out = center - half*cosine
+        weight_out = weights*half*np.pi*np.sin(np.pi*nodes)
+        
+        # full circle if inside: periodic
+        beta_in = 2*np.pi*(np.arange(npts)+0.5)/npts
+        weight_in = np.full(npts, 2*np.pi/npts)
+        
+        beta = np.where(inside, beta_in, beta_out)
+        weight = np.where(inside, weight_in, weight_out)
+        
+    else:
+        corners = np.sort(np.concatenate([np.arctan2(m2+j, m1+i) for i, j in 
+                            ((1, 1), (1, -1), (-1, 1), (-1, -1))], axis=-1), 
+                          axis=-1)
+        
+        # split circle into four intervals
+        lo = corners
+        hi = np.concatenate((corners[..., 1:], corners[..., :1]+2*np.pi), axis=-1)
+        nodes, weights = _leggauss(int(np.ceil(npts/4)))
+        
+        beta = lo[..., None] + (hi-lo)[..., None]*nodes
+        weight = (hi-lo)[..., None]*weights
+        beta = beta.reshape(beta.shape[:-2]+(-1, ))
+        weight = weight.reshape(weight.shape[:-2]+(-1, ))
+    
+    e1 = np.cos(beta)
+    e2 = np.sin(beta)
+    
+    # ray intersection with shape in q coordinates
+    with np.errstate(divide='ignore', invalid='ignore'):
+        
+        # circle: quadratic in s
+        if norm == 2:
+            b = e1*m1 + e2*m2
+            disc = b*b - (m1*m1 + m2*m2 - 1)
+            root = np.sqrt(np.clip(disc, 0, None))
+            s1 = b-root
+            s2 = np.where(disc > 0, b+root, s1)
+        
+        # square: intersection of two slabs
+        else:
+            s1 = -np.inf
+            s2 = np.inf
+            for e, m in ((e1, m1), (e2, m2)):
+                a1 = (m-1)/e
+                a2 = (m+1)/e
+                inside = np.abs(m) <= 1
+                s1 = np.maximum(s1, np.where(e != 0, np.minimum(a1, a2), 
+                                             np.where(inside, -np.inf, np.inf)))
+                s2 = np.minimum(s2, np.where(e != 0, np.maximum(a1, a2), 
+                                             np.where(inside, np.inf, -np.inf)))
+    
+    # only the part of the ray in front of the center
+    s1 = np.clip(s1, 0, None)
+    s2 = np.maximum(s1, s2)
+    
+    # whitened radius and change of variables
+    me1 = (cp*h1*e1 - sp*h2*e2)/sx
+    me2 = (sp*h1*e1 + cp*h2*e2)/sy
+    me = me1*me1 + me2*me2
+    jac = h1*h2/(sx*sy)/me
+    
+    t1 = s1*s1*me
+    t2 = s2*s2*me
+    
+    prob = np.sum(weight*jac*(np.exp(-0.5*t1) - np.exp(-0.5*t2)), axis=-1)/(2*np.pi)
+    
+    if prob.ndim == 0:
+        return float(prob)
+    return prob
+    
+# =========================================================================== #
+def circle(par, x, y, r, npts=npts):
+    """
+        Overlap with circles
+
+        x, y:   center
+        r:      radius
+        npts:   number of ray angles
+    """
+    return ellipse(par, x, y, r, r, 0, npts=npts)
+
+# =========================================================================== #
+def ellipse(par, x, y, r1, r2, angle=0, npts=npts):
+    """
+        Overlap with ellipses
+
+        x, y:   center
+        r1:     semi-axis along angle
+        r2:     semi-axis perpendicular to angle
+        angle:  rotation of the r1 axis from the x axis
+        npts:   number of ray angles
+    """
+    return _rays(par, x, y, r1, r2, angle, 2, npts)
+
+# =========================================================================== #
+def rectangle(par, x, y, dx, dy, angle=0, npts=npts):
+    """
+        Overlap with rectangles. Exact if the rectangle sides are parallel to
+        the gaussian axes.
+
+        x, y:   center
+        dx:     side length along angle
+        dy:     side length perpendicular to angle
+        angle:  rotation of the dx side from the x axis
+        npts:   number of ray angles, if not aligned
+    """
+
+    sx, sy, uc, vc, psi = _local(par, x, y, dx, dy, angle)
+
+    h1 = np.asarray(dx, dtype=float)/2
+    h2 = np.asarray(dy, dtype=float)/2
+
+    # alignment with the gaussian axes
+    cp = np.cos(psi)
+    sp = np.sin(psi)
+    aligned = np.isclose(cp*sp, 0, atol=1e-12)
+
+    # swap sides if rotated by 90 degrees
+    swap = np.abs(sp) > np.abs(cp)
+    hu = np.where(swap, h2, h1)
+    hv = np.where(swap, h1, h2)
+
+    prob = _erf_interval(uc, hu, sx)*_erf_interval(vc, hv, sy)
+
+    if np.all(aligned):
+        if prob.ndim == 0:
+            return float(prob)
+        return prob
+
+    prob = np.where(aligned, prob, _rays(par, x, y, h1, h2, angle, np.inf, npts))
+    if prob.ndim == 0:
+        return float(prob)
+    return prob
+
+# =========================================================================== #
+def region(par, ylo, yhi, xlo, xhi):
+    """
+        Overlap with a general region, integration is
+
+            int_ylo^yhi int_xlo(y)^xhi(y) G(x, y) dx dy
+
+        The inner integral is calculated exactly, the outer with quad.
+
+        ylo, yhi:   float, outer integration bounds
+        xlo, xhi:   function of y or float, inner integration bounds
+    """
+
+    x0, y0, sigmax, sigmay, _, theta = par
+
+    # covariance matrix
+    ct = np.cos(theta)
+    st = np.sin(theta)
+    sxx = (ct*sigmax)**2 + (st*sigmay)**2
+    syy = (st*sigmax)**2 + (ct*sigmay)**2
+    sxy = -ct*st*(sigmax**2 - sigmay**2)
+
+    # distribution of x conditional on y
+    slope = sxy/syy
+    sig = np.sqrt(sxx - sxy*slope)
+
+    # inner bounds
+    if not callable(xlo):   xlo = (lambda value: lambda y: value)(xlo)
+    if not callable(xhi):   xhi = (lambda value: lambda y: value)(xhi)
+
+    def inner(y):
+        mu = x0 + slope*(y-y0)
+        s = np.sqrt(2)*sig
+        px = 0.5*(erf((xhi(y)-mu)/s) - erf((xlo(y)-mu)/s))
+        py = np.exp(-0.5*(y-y0)**2/syy)/np.sqrt(2*np.pi*syy)
+        return px*py
+
+    # nothing beyond 12 sigma: keeps quad on the beam
+    sig_y = np.sqrt(syy)
+    ylo = max(ylo, y0-12*sig_y)
+    yhi = min(yhi, y0+12*sig_y)
+    
+    if ylo >= yhi:
+        return 0.
+    
+    points = [p for p in (y0-3*sig_y, y0, y0+3*sig_y) if ylo < p < yhi]
+    
+    return quad(inner, ylo, yhi, points=points or None, limit=200)[0]
+
+# =========================================================================== #
+def square(par, x, y, side, angle=0, npts=npts):
+    """
+        Overlap with squares
+
+        x, y:   center
+        side:   side length
+        angle:  rotation from the x axis
+        npts:   number of ray angles, if not aligned
+    """
+    return rectangle(par, x, y, side, side, angle, npts=npts)
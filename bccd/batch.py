@@ -0,0 +1,227 @@
+# Command line batch analysis of image files, without the gui
+# Derek Fujimoto
+# Oct 2026
+
+import argparse
+import glob
+import os
+import sys
+import numpy as np
+
+# =========================================================================== #
+def get_filenames(patterns):
+    """
+        Expand glob patterns, recursive with **, removing duplicates
+
+        returns: sorted list of paths
+    """
+    filenames = set()
+    for pattern in patterns:
+        filenames.update(glob.glob(pattern, recursive=True))
+    return sorted(filenames)
+
+# =========================================================================== #
+def watch(watcher, output=None, fieldnames=None):
+    """
+        Write a csv row for each new file found by a Watcher, until 
+        interrupted. Files which fail are reported on stderr. 
+        
+        watcher:    Watcher, started
+        output:     csv file to append to. If None, write to stdout
+        fieldnames: list of columns. If None, use the columns of the first 
+                    result and write them as a header
+        
+        returns: number of files which failed
+    """
+    import csv
+    
+    if output is None:
+        fid = sys.stdout
+    else:
+        fid = open(output, 'a', newline='')
+    
+    writer = None
+    if fieldnames is not None:
+        writer = csv.DictWriter(fid, fieldnames, extrasaction='ignore')
+    
+    nerr = 0
+    try:
+        while True:
+            for img, record in watcher.get(timeout=1):
+                
+                if 'error' in record:
+                    print('%s: %s' % (record['filename'], record['error']), 
+                          file=sys.stderr, flush=True)
+                    nerr += 1
+                    continue
+                
+                if writer is None:
+                    writer = csv.DictWriter(fid, list(record.keys()), 
+                                            extrasaction='ignore')
+                    writer.writeheader()
+                
+                writer.writerow(record)
+                fid.flush()
+                
+    except KeyboardInterrupt:
+        pass
+    
+    finally:
+        watcher.stop()
+        if output is not None:
+            fid.close()
+    
+    return nerr
+
+# =========================================================================== #
+def write(df, output):
+    """
+        Write DataFrame to csv or parquet based on file extension. If output
+        is None, write csv to stdout.
+    """
+    if output is None:
+        df.to_csv(sys.stdout, index=False)
+    elif output.endswith('.parquet'):
+        df.to_parquet(output, index=False)
+    else:
+        df.to_csv(output, index=False)
+
+# =========================================================================== #
+def main(args=None):
+
+    from bccd import __version__
+    from bccd.backend.analysis import analyses
+    from bccd.backend.ResultsStore import ResultsStore
+
+    parser = argparse.ArgumentParser(prog='bccd-batch',
+                description='Analyze beamspot images without drawing. '+\
+                            'Results are written one row per file.')
+
+    parser.add_argument('patterns', nargs='*',
+                        help='files or glob patterns (use ** to recurse), quote to '+\
+                             'prevent shell expansion')
+    parser.add_argument('-a', '--analyses', default='center,gaussian2D',
+                        help='comma-separated list from: %s (default: %%(default)s)' %\
+                             ', '.join(analyses))
+    parser.add_argument('-o', '--output', default=None,
+                        help='output .csv or .parquet file (default: csv to stdout)')
+    parser.add_argument('-j', '--nproc', type=int, default=None,
+                        help='number of processes (default: number of cores)')
+    parser.add_argument('--black', type=float, default=None,
+                        help='pixel value to set to black')
+    parser.add_argument('--mask', type=float, nargs=3, metavar=('X', 'Y', 'R'),
+                        default=None, help='exclude pixels outside of this circle')
+    parser.add_argument('--no-rescale', action='store_true',
+                        help='do not rescale images to square pixels')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='do not use the on-disk cache of rescaled images')
+    parser.add_argument('--store', default=None,
+                        help='results database: only new or changed files are '+\
+                             'analyzed (default: %s)' % ResultsStore.path)
+    parser.add_argument('--no-store', action='store_true',
+                        help='do not read or save stored results')
+    parser.add_argument('--refresh', action='store_true',
+                        help='analyze all files, replacing stored results')
+    parser.add_argument('-w', '--watch', default=None, metavar='DIR',
+                        help='then watch DIR for new images and write a row as '+\
+                             'each arrives, until interrupted (csv only)')
+
+    # targets for overlap
+    parser.add_argument('--circle', type=float, nargs=3, action='append',
+                        metavar=('X', 'Y', 'R'), default=[],
+                        help='overlap of fitted beam with circle (repeatable)')
+    parser.add_argument('--square', type=float, nargs=3, action='append',
+                        metavar=('X', 'Y', 'SIDE'), default=[],
+                        help='overlap of fitted beam with square (repeatable)')
+    parser.add_argument('--rectangle', type=float, nargs=4, action='append',
+                        metavar=('X', 'Y', 'DX', 'DY'), default=[],
+                        help='overlap of fitted beam with rectangle (repeatable)')
+    parser.add_argument('--ellipse', type=float, nargs=5, action='append',
+                        metavar=('X', 'Y', 'R1', 'R2', 'ANGLE'), default=[],
+                        help='overlap of fitted beam with ellipse, angle in degrees '+\
+                             '(repeatable)')
+
+    parser.add_argument('--version', action='version',
+                        version='%(prog)s ' + __version__)
+
+    args = parser.parse_args(args)
+
+    # check analyses
+    selected = [a.strip() for a in args.analyses.split(',') if a.strip()]
+    for a in selected:
+        if a not in analyses:
+            parser.error('unknown analysis "%s"' % a)
+
+    # targets, in order given on command line by type
+    targets = [('circle', *t) for t in args.circle] + \
+              [('square', *t) for t in args.square] + \
+              [('rectangle', *t) for t in args.rectangle] + \
+              [('ellipse', *t[:4], t[4]*np.pi/180) for t in args.ellipse]
+
+    if args.watch is not None:
+        if not os.path.isdir(args.watch):
+            parser.error('%s is not a directory' % args.watch)
+        if args.output is not None and args.output.endswith('.parquet'):
+            parser.error('--watch can only write csv')
+    elif not args.patterns:
+        parser.error('no files given')
+    
+    filenames = get_filenames(args.patterns)
+    if args.patterns and not filenames:
+        parser.error('no files match %s' % ' '.join(args.patterns))
+    
+    options = {'analyses':          selected, 
+               'targets':           targets, 
+               'rescale_pixels':    not args.no_rescale, 
+               'use_cache':         not args.no_cache, 
+               'mask':              args.mask, 
+               'black':             args.black}
+    
+    # start watching first, so that no new files are missed
+    if args.watch is not None:
+        from bccd.backend.Watcher import Watcher
+        watcher = Watcher(args.watch, **options)
+        watcher.start()
+        print('Watching %s' % os.path.abspath(args.watch), file=sys.stderr)
+    
+    # describe targets
+    for i, target in enumerate(targets):
+        print('overlap_%d: %s' % (i, ' '.join(map(str, target))), file=sys.stderr)
+    
+    # only watch
+    if not filenames:
+        return int(watch(watcher, args.output) > 0)
+
+    if args.no_store:
+        store = None
+    else:
+        store = ResultsStore(args.store)
+    
+    from bccd.backend.analysis import analyze_files
+    df = analyze_files(filenames,
+                       nproc=args.nproc,
+                       store=store,
+                       refresh=args.refresh,
+                       **options)
+
+    write(df, args.output)
+
+    if store is not None:
+        print('%d of %d files from stored results' % (store.hits, len(df)), 
+              file=sys.stderr)
+
+    # exit status is 1 if any file failed
+    nerr = 0
+    if 'error' in df.columns:
+        nerr = df['error'].notna().sum()
+        print('%d of %d files failed' % (nerr, len(df)), file=sys.stderr)
+    
+    # new files, in the same columns
+    if args.watch is not None:
+        sys.stdout.flush()
+        nerr += watch(watcher, args.output, fieldnames=list(df.columns))
+    
+    return int(nerr > 0)
+
+if __name__ == '__main__':
+    sys.exit(main())
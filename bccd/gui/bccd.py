@@ -9,7 +9,7 @@ from tkinter import ttk, filedialog, messagebox
 import matplotlib as mpl
 mpl.use('TkAgg')
 
-import sys, os, datetime, yaml, subprocess, textwrap
+import sys, os, datetime, time, yaml, subprocess, textwrap
 import matplotlib.pyplot as plt
 import numpy as np
 import weakref as wref
@@ -17,6 +17,11 @@ import subprocess
 
 from bccd import __version__, icon_path
 from bccd.backend.PltTracker import PltTracker
+from bccd.backend.Catalog import Catalog
+from bccd.backend.ImageLoader import ImageLoader
+from bccd.backend.RemoteSync import RemoteSync
+from bccd.backend.ResultsStore import ResultsStore
+from bccd.backend.Watcher import Watcher
 from bccd.gui.fits_tab import fits_tab
 from bccd.gui.popup_target import popup_target
 import bccd.backend.colors as colors
@@ -35,13 +40,25 @@ class bccd(object):
         
         Data Fields:
        
+            catalog: Catalog of local image files
             draw_new_target: BooleanVar, if true, draw new also draws targets
             draw_title: BooleanVar, if true, add title to figures
+            live: BooleanVar, if true, show new images as they arrive
+            loader: ImageLoader, reads images in the background
+            live_analysis: StringVar, analysis of new images in live mode
+            live_tab: fits_tab showing new images in live mode, or None
             mainframe: frame for root
+            memory: StringVar, memory used by images
             notebook: notebook for adding files
+            remote_sync: RemoteSync, copies images from data_remote in the 
+                         background
+            results: ResultsStore of analysis results from bccd-batch
+            status: StringVar, remote sync progress
+            status_lines: dict, last remote sync message for each remote
             sync: BooleanVar, if true, sync data with remote servers
             tabs: list of fits_tabs objects which have been fetched fits_tabs
             targets: list of popup_target objects
+            watcher: Watcher of local image files in live mode, or None
     """
     
     # image fetch locations
@@ -57,6 +74,19 @@ class bccd(object):
     # rescale pixels flag
     rescale_pixels = True
     
+    # ms between checks for new images in live mode
+    live_interval = 100
+    
+    # ms between checks of remote sync progress
+    sync_interval = 200
+    
+    # number of newest images to read before they are opened
+    nprefetch = 3
+    
+    # bytes of pixel arrays to keep for open tabs, the least recently used
+    # are freed beyond this
+    memory_budget = 1024**3
+    
     # ======================================================================= #
     def __init__(self):
         """"""
@@ -90,6 +120,7 @@ class bccd(object):
         root.bind('<Control-w>', self.key_ctrl_w)
         root.bind('<Control-o>', self.key_ctrl_o)
         root.bind('<Control-l>', self.key_ctrl_l)
+        root.bind('<Control-L>', self.key_ctrl_shift_l)
         root.bind('<Control-t>', self.key_ctrl_t)
         
         # styling
@@ -185,6 +216,8 @@ class bccd(object):
         menu_file.add_checkbutton(label="Include figure titles", \
                 variable=self.draw_title, selectcolor=colors.selected)
         
+        menu_file.add_command(label='Full Remote Sync', 
+                              command=lambda: self.get_data(full=True))
         menu_file.add_command(label='Close All Figures', command=self.close_all)
         menu_file.add_command(label='Exit', command=sys.exit)
         menubar.add_cascade(menu=menu_file, label='File')
@@ -201,9 +234,30 @@ class bccd(object):
         menubar.add_checkbutton(label="Draw New With Targets", \
                 variable=self.draw_new_target, selectcolor=colors.selected)
         
+        # live mode
+        menu_live = Menu(menubar)
+        
+        self.live = BooleanVar()
+        self.live.set(False)
+        menu_live.add_checkbutton(label="Show New Images", \
+                variable=self.live, selectcolor=colors.selected, 
+                command=self.set_live)
+        menu_live.add_separator()
+        
+        self.live_analysis = StringVar()
+        self.live_analysis.set('moments')
+        menu_live.add_radiobutton(label='Beam From Moments', value='moments', 
+                variable=self.live_analysis, selectcolor=colors.selected, 
+                command=self.set_live)
+        menu_live.add_radiobutton(label='Beam From 2D Gaussian Fit', 
+                value='gaussian2D', variable=self.live_analysis, 
+                selectcolor=colors.selected, command=self.set_live)
+        menubar.add_cascade(menu=menu_live, label='Live')
+        
         # Top Notebook --------------------------------------------------------
         noteframe = ttk.Frame(self.mainframe, relief='sunken', pad=5)
         self.notebook = ttk.Notebook(noteframe)
+        self.notebook.bind('<<NotebookTabChanged>>', self._select_tab)
         
         # Buttons -------------------------------------------------------------
         button_add_file = ttk.Button(self.mainframe, text='Add Image', 
@@ -213,11 +267,22 @@ class bccd(object):
         button_target = ttk.Button(self.mainframe, text='New Target', 
                                      command=self.addtarget, pad=5)
         
+        # sync status
+        self.status = StringVar()
+        label_status = ttk.Label(self.mainframe, textvariable=self.status, 
+                                 justify=LEFT)
+        
+        # image memory
+        self.memory = StringVar()
+        label_memory = ttk.Label(self.mainframe, textvariable=self.memory)
+        
         # gridding
         self.notebook.grid(column=0, row=0, sticky=(N, E, W, S))
         button_target.grid(column=0, row=1, sticky=(E, S))
         button_add_file.grid(column=1, row=1, sticky=(E, S))
         button_addlast_file.grid(column=2, row=1, sticky=(E, S))
+        label_status.grid(column=0, row=2, sticky=(W, S))
+        label_memory.grid(column=1, row=2, sticky=(E, S), columnspan=3)
         noteframe.grid(column=0, row=0, sticky=(N, E, W, S), columnspan=4, 
                        pady=(0, 10))
         noteframe.columnconfigure(0, weight=1)
@@ -226,17 +291,40 @@ class bccd(object):
         # make data directory
         os.makedirs(self.data_local, exist_ok=True)
         
+        # index of local image files
+        self.catalog = Catalog(self.data_local)
+        self._catalog_job = None
+        
+        # stored analysis results
+        self.results = ResultsStore()
+        
+        # read images in the background, starting with the newest
+        self.loader = ImageLoader(nprefetch=self.nprefetch, 
+                                  results=self.results.path)
+        self._prefetch()
+        
+        # copy images from the camera computers
+        self.remote_sync = RemoteSync(self.data_remote, self.data_local, 
+                            manifest=os.path.join(self.data_local, '.sync.sqlite'), 
+                            catalog=self.catalog.path)
+        self.status_lines = {}
+        
         # intialize tabs list
         self.tabs = []
         
         # intialize targets list
         self.targets = []
+        
+        # live mode
+        self.live_tab = None
+        self.watcher = None
+        self._live_job = None
 
         # runloop
         self.root.mainloop()
     
     # ======================================================================= #
-    def _add_tab(self, filename):
+    def _add_tab(self, filename, img=None):
         
         if len(self.tabs) > 0:
             new_key = max([t.id for t in self.tabs])+1
@@ -246,7 +334,8 @@ class bccd(object):
         tab_frame = ttk.Frame(self.notebook, pad=5)
         self.notebook.add(tab_frame, text='Img %d' % (new_key+1))
         
-        self.tabs.append(fits_tab(wref.proxy(self), tab_frame, filename, new_key))
+        self.tabs.append(fits_tab(wref.proxy(self), tab_frame, filename, new_key, 
+                                  img=img))
         self.notebook.select(len(self.tabs)-1)
         
         # set alpha to prior image value
@@ -260,6 +349,140 @@ class bccd(object):
         else:
             self.tabs[-1].input_objs['alpha'][0].set(alpha)
         
+    # ======================================================================= #
+    def _live_update(self):
+        """
+            Show the newest image found by the watcher, then check again after
+            live_interval
+        """
+        
+        results = self.watcher.get()
+        
+        # files which could not be read are tried again when they change, 
+        # images which failed analysis (ex: no beam) are still shown
+        for img, record in results:
+            if 'error' in record:
+                print('%s: %s' % (record['filename'], record['error']), 
+                      flush=True)
+        
+        results = [r for r in results if r[0] is not None]
+        
+        # only draw the newest image
+        if results:
+            img, record = results[-1]
+            self.cwd = os.path.dirname(img.filename)
+            
+            # live tab was closed
+            if self.live_tab not in self.tabs:
+                self.live_tab = None
+            
+            if self.live_tab is None:
+                self._add_tab(img.filename, img=img)
+                self.live_tab = self.tabs[-1]
+                self.notebook.tab(self.live_tab.tab_frame, text='Live')
+                self.live_tab.set_labels(record)
+                self.live_tab.draw_new()
+            else:
+                self.live_tab.update_image(img, record)
+        
+        self._live_job = self.root.after(self.live_interval, self._live_update)
+        
+    # ======================================================================= #
+    def _draw_loaded(self, tabs):
+        """
+            Draw tabs in order once their images are loaded: the first in a 
+            new figure, the rest superimposed. 
+        """
+        
+        tabs = [t for t in tabs if t in self.tabs]
+        
+        if any(t.is_loading() for t in tabs):
+            self.root.after(fits_tab.load_interval, self._draw_loaded, tabs)
+            return
+        
+        # one redraw once all are drawn
+        tabs = [t for t in tabs if t.img is not None]
+        with self.plt.transaction():
+            for i, tab in enumerate(tabs):
+                if i == 0:
+                    tab.draw_new()
+                else:
+                    tab.draw()
+    
+    # ======================================================================= #
+    def _prefetch(self):
+        """Read the newest images in the background, so they open quickly"""
+        self.loader.prefetch(self.catalog.recent(self.nprefetch), 
+                             rescale_pixels=self.rescale_pixels)
+        
+    # ======================================================================= #
+    def _scan_catalog(self):
+        """
+            Update the catalog with files already copied. Runs in the loader's 
+            threads, with its own database connection.
+            
+            returns: list of paths which were added or changed
+        """
+        return Catalog(self.data_local, self.catalog.path).update()
+        
+    # ======================================================================= #
+    def _scan_update(self):
+        """
+            Check if the catalog update is done, and check again after 
+            sync_interval until it is
+        """
+        
+        if not self._catalog_job.done():
+            self.root.after(self.sync_interval, self._scan_update)
+            return
+        
+        try:
+            changed = self._catalog_job.result()
+        except Exception as err:
+            print("Catalog update failed: %s" % err, flush=True)
+        else:
+            if changed:
+                print("Found %d new files in %s" % (len(changed), self.data_local), 
+                      flush=True)
+            self._prefetch()
+        
+    # ======================================================================= #
+    def _select_tab(self, *args):
+        """Mark the selected tab as used"""
+        try:
+            idx = self.notebook.index('current')
+        except TclError:
+            return
+        
+        if idx < len(self.tabs):
+            self.tabs[idx].last_used = time.monotonic()
+        
+    # ======================================================================= #
+    def _sync_update(self):
+        """
+            Show remote sync progress, and check again after sync_interval
+            until done
+        """
+        
+        # last line of rsync output for each remote
+        for remote, message, returncode in self.remote_sync.get():
+            name = remote.split(':')[0]
+            self.status_lines[name] = message
+            if returncode is not None:
+                print("Fetching data from %s: %s" % (remote, message), flush=True)
+        
+        status = '\n'.join('%s: %s' % item for item in self.status_lines.items())
+        
+        # new files are added to the catalog by remote_sync
+        if self.remote_sync.is_alive():
+            self.root.after(self.sync_interval, self._sync_update)
+        else:
+            status = 'Synced at %s\n%s' % \
+                     (datetime.datetime.now().strftime('%H:%M:%S'), status)
+            self._prefetch()
+        
+        self.status.set(status)
+        
     # ======================================================================= #
     def add_file(self):
         """
@@ -285,26 +508,19 @@ class bccd(object):
     # ======================================================================= #
     def addlast_file(self):
         """
-            Add tab based on last modified file
-            
+            Add tab based on last modified file in the catalog. Files found 
+            by the catalog update started here are included from the next call.
         """
         
         # get data
         self.get_data()
         
-        # get filenames of all files in directory system and their modification 
-        # times
-        latest_file = ''
-        latest_time = 0
+        # get last modified file from the catalog
+        latest_file = self.catalog.latest()
         
-        for dirpath, dirnames, filenames in os.walk(self.data_local):
-            for f in filenames:
-                fname = os.path.join(dirpath, f)
-                mod_time = os.stat(fname).st_mtime
-                
-                if mod_time > latest_time:
-                    latest_time = mod_time
-                    latest_file = fname                
+        if latest_file is None:
+            messagebox.showerror('No images', 'No images found in %s' % self.data_local)
+            return
         
         self.cwd = os.path.split(os.path.abspath(latest_file))[0]
         
@@ -346,27 +562,50 @@ class bccd(object):
         self.plt.active = 0
 
     # ====================================================================== #
-    def get_data(self):
-        """Fetch the images from a remote location"""
+    def get_beam(self):
+        """
+            Get the beam position and shape in the active figure, from the 
+            last image drawn there whose beam is known (see fits_tab.get_beam)
+            
+            returns: gaussian2D parameters, or None
+        """
+        
+        if not self.plt.plots:
+            return None
+        
+        # newest image first
+        drawn = getattr(self.plt.gca(), 'draw_objs', {})
+        for filename in reversed(tuple(drawn.keys())):
+            for tab in self.tabs:
+                if tab.filename == filename:
+                    par = tab.get_beam()
+                    if par is not None:
+                        return par
+        
+        return None
+        
+    # ====================================================================== #
+    def get_data(self, full=False):
+        """
+            Update the catalog with files already copied, and start fetching 
+            the images from the remote locations, both in the background. New 
+            files are added to the catalog when done. 
+            
+            full: if True, list all remote files, not only those in recently 
+                  changed directories
+        """
+        
+        # one update of the local files at a time
+        if self._catalog_job is None or self._catalog_job.done():
+            self._catalog_job = self.loader.executor.submit(self._scan_catalog)
+            self.root.after(self.sync_interval, self._scan_update)
         
         if not self.sync.get():
             return
         
-        for loc in self.data_remote:
-            
-            # make destination location 
-            dest = os.path.join(self.data_local, loc.split(':')[0])
-            os.makedirs(dest, exist_ok=True)
-            
-            # rsync
-            print("Fetching data from %s:" % loc, flush=True)
-            subprocess.call(['rsync', 
-                             '-az', 
-                             '--progress', 
-                             '--update', 
-                             '--inplace', 
-                             '--human-readable', 
-                             os.path.join(loc, '*'), dest])
+        if self.remote_sync.start(full=full):
+            self.status_lines = {}
+            self.root.after(self.sync_interval, self._sync_update)
             
     # ====================================================================== #
     def key_ctrl_l(self, *args):
@@ -376,6 +615,15 @@ class bccd(object):
         """
         self.addlast_file()
     
+    # ====================================================================== #
+    def key_ctrl_shift_l(self, *args):
+        """
+            Bound to <Control-Key-L>. 
+            Toggle live mode
+        """
+        self.live.set(not self.live.get())
+        self.set_live()
+    
     # ====================================================================== #
     def key_ctrl_n(self, n, *args):
         """
@@ -445,6 +693,10 @@ class bccd(object):
     def on_closing(self):
         """Excecute this when window is closed: destroy and close all plots."""
         # ~ self.logger.info('Closing all windows.')
+        if self.watcher is not None:
+            self.watcher.stop(timeout=0)
+        self.remote_sync.stop()
+        self.loader.shutdown()
         plt.close('all')
         self.root.destroy()
     
@@ -462,6 +714,7 @@ class bccd(object):
             data = yaml.safe_load(fid)
             
         # add images as tabs
+        tabs = []
         for i, val in enumerate(data):
             
             # add tab
@@ -500,11 +753,10 @@ class bccd(object):
             if 'sigma' in val.keys():
                 tab.input_objs['sigma'][0].set(val['sigma'])
             
-            # draw the image
-            if i == 0:
-                tab.draw_new()
-            else:
-                tab.draw()
+            tabs.append(tab)
+        
+        # draw the images in order, when read
+        self._draw_loaded(tabs)
         
     # ======================================================================= #
     def set_icon(self, window):
@@ -515,6 +767,35 @@ class bccd(object):
         except Exception as err:
             print(err)
         
+    # ======================================================================= #
+    def set_live(self, *args):
+        """
+            Start or stop showing new images as they arrive in data_local, 
+            based on self.live. New images are loaded and analyzed in the 
+            background, and replace the image in the live tab. 
+        """
+        
+        # stop
+        if self._live_job is not None:
+            self.root.after_cancel(self._live_job)
+            self._live_job = None
+        
+        # don't wait for the fit in progress: the thread ends by itself
+        if self.watcher is not None:
+            self.watcher.stop(timeout=0)
+            self.watcher = None
+        
+        if not self.live.get():
+            return
+        
+        # start
+        self.watcher = Watcher(self.data_local, 
+                               analyses=(self.live_analysis.get(), ), 
+                               catalog=self.catalog.path, 
+                               rescale_pixels=self.rescale_pixels)
+        self.watcher.start()
+        self._live_job = self.root.after(self.live_interval, self._live_update)
+        
     # ======================================================================= #
     def show_keys(self):
         """
@@ -525,6 +806,7 @@ class bccd(object):
         Command             Action
         
         <ctrl> + <l>        Add last
+        <ctrl> + <L>        Live mode on/off
         <ctrl> + <o>        Add image
         <ctrl> + <t>        New target
         <ctrl> + <w>        Close tab
@@ -535,3 +817,55 @@ class bccd(object):
         
         messagebox.showinfo(title="Keyboard Shortcuts", 
                             message=textwrap.dedent(message))
+        
+    # ======================================================================= #
+    def update_memory(self):
+        """
+            Free the pixels of the least recently used tabs until the images 
+            fit in memory_budget, and show the memory used. Freed images are 
+            read again (from the rescale cache or the memory-mapped file) when 
+            drawn. The selected tab is not freed. 
+        """
+        
+        # new tabs are in the notebook before they are in self.tabs
+        try:
+            selected = self.tabs[self.notebook.index('current')]
+        except (TclError, IndexError):
+            selected = None
+        
+        tabs = [t for t in self.tabs if t.img is not None]
+        blocks = [t.img.get_memory_blocks() for t in tabs]
+        
+        # tabs of the same file share their pixels: count them once
+        def get_total():
+            shared = {}
+            for b in blocks:
+                shared.update(b)
+            return sum(shared.values())
+        
+        total = get_total()
+        
+        # least recently used first
+        for i in sorted(range(len(tabs)), key=lambda i: tabs[i].last_used):
+            if total <= self.memory_budget:
+                break
+            
+            tab = tabs[i]
+            if not blocks[i] or tab is selected:
+                continue
+            
+            tab.img.unload()
+            blocks[i] = {}
+            total = get_total()
+        
+        nloaded = sum(bool(b) for b in blocks)
+        self.memory.set('Images: %.0f MB in %d of %d tabs, %.0f MB prefetched' % \
+                        (total/1024**2, nloaded, len(self.tabs), 
+                         self.loader.nbytes/1024**2))
+        
+    # ======================================================================= #
+    def update_overlaps(self):
+        """Show the overlap of each target with the beam in the active figure"""
+        for popup in self.targets:
+            if popup.target is not None:
+                popup.target.update_overlap()
@@ -6,10 +6,13 @@ from tkinter import *
 from tkinter import ttk, messagebox, filedialog
 
 import os
+import time
 import numpy as np
 import pandas as pd
 
 from bccd.backend.fits import fits
+from bccd.backend.header import get_datetime, read_header
+from bccd.backend import analysis
 import bccd.backend.colors as colors
 from bccd.backend.PltTracker import PltTracker as plt
 from functools import partial
@@ -26,16 +29,27 @@ class fits_tab(object):
             entry_black: Entry widget for black value
             entry_white: Entry widget for white value
             filename: name of .fits file
+            header: dict, header of the .fits file
             id: id number for later deletion (key in bccd.tabs)
             input_names: dict, map input names to nice titles
             input_objs: dict of objects corresponding to input fields 
                              {input_name:(value, field, label)}
-            img: fits image object
+            img: fits image object, or None while loading
+            label_beam: Label showing the beam position and width
+            label_date: Label showing the date the image was taken
+            label_exposure: Label showing the exposure time
+            label_filename: Label showing the file name
+            label_time: Label showing the time the image was taken
+            last_used: float, time.monotonic() when last drawn or selected, 
+                       for freeing the pixels of tabs not in use (see 
+                       bccd.update_memory)
             old_alpha: int, last alpha draw value
             old_color: string, last color draw value
             plt: PltTracker obj, set to point at bccd.plt
+            record: dict, analysis results shown in label_beam, or None
             style: StringVar, drawing style
-            styles: dict, map drawing style to draw function and input names
+            styles: dict, map drawing style to fits draw function name and 
+                    input names
             tab_frame: tkk.Frame; top level frame for this tab
             white: StringVar, white level
     """
@@ -97,6 +111,9 @@ class fits_tab(object):
                 'hsv':         True, 
                 }
     
+    # ms between checks if the image is loaded
+    load_interval = 50
+    
     input_names = {'alpha':'Alpha (%): ', 
                    'cmap':'Colour Map: ', 
                    'nlevels':'Num. Contours: ', 
@@ -104,7 +121,11 @@ class fits_tab(object):
                    'imap':'Invert Colour Map'}
     
     # ======================================================================= #
-    def __init__(self, bccd, tab_frame, filename, id):
+    def __init__(self, bccd, tab_frame, filename, id, img=None):
+        """
+            img: fits object, or Future of one (see ImageLoader). If None, 
+                 load filename in the background. 
+        """
         
         # inputs
         self.id = id
@@ -114,25 +135,37 @@ class fits_tab(object):
         self.filename = filename
         self.old_color = tuple(self.colours.keys())[0]
         self.old_alpha = 100
+        self.last_used = time.monotonic()
 
-        # read image
-        img = fits(filename, plt=bccd.plt, rescale_pixels=bccd.rescale_pixels)
-        self.img = img
+        # read image in the background, only the header for now
+        if img is None:
+            img = bccd.loader.load(filename, rescale_pixels=bccd.rescale_pixels)
+        
+        self.img = None
+        self.record = None
+        self._load_job = None
+        self._find_job = None
+        self._on_load = None
+        
+        if isinstance(img, fits):
+            self.header = img.header
+        else:
+            self.header = read_header(filename)
         
         # variables
         self.black = StringVar()
-        self.black.set(str(img.black/1e4))
+        self.black.set(str(self.header['BZERO']/1e4))
         
         self.white = StringVar()
-        self.white.set(str(img.white/1e4))
+        self.white.set(str(np.inf))
         
         self.style = StringVar()
         
         # function, input names
-        self.styles = { 'Greyscale':    (self.img.draw, 'alpha', 'cmap', 'imap'), 
-                        'Contours':     (self.img.draw_contour, 'alpha', 'nlevels', 'cmap', 'imap'), 
-                        'Gradient':     (self.img.draw_sobel, 'alpha', 'cmap', 'imap'), 
-                        'Edges':        (self.img.draw_edges, 'alpha', 'sigma', 'cmap', 'imap'), 
+        self.styles = { 'Greyscale':    ('draw', 'alpha', 'cmap', 'imap'), 
+                        'Contours':     ('draw_contour', 'alpha', 'nlevels', 'cmap', 'imap'), 
+                        'Gradient':     ('draw_sobel', 'alpha', 'cmap', 'imap'), 
+                        'Edges':        ('draw_edges', 'alpha', 'sigma', 'cmap', 'imap'), 
                         }
                         
         # set draw style to previous
@@ -149,18 +182,18 @@ class fits_tab(object):
         frame_column0 = ttk.Frame(tab_frame, relief='sunken', pad=5)
         frame_column0.grid(column=0, row=0, sticky=(N, W, E), padx=5, pady=5)
         
-        # show main title and exposure
-        ttk.Label(frame_column0, 
-                  text=os.path.basename(filename)).grid(column=0, row=r, sticky=W); r+=1
-        ttk.Label(frame_column0, 
-                  text='Exposure: %.3f s'%img.header['EXPOSURE']).grid(column=0, row=r, sticky=W); r+=1
+        # file name, exposure, date and time, and beam position
+        self.label_filename = ttk.Label(frame_column0)
+        self.label_exposure = ttk.Label(frame_column0)
+        self.label_date = ttk.Label(frame_column0)
+        self.label_time = ttk.Label(frame_column0)
+        self.label_beam = ttk.Label(frame_column0, justify=LEFT)
         
-        # show date and time, converted from utc to local
-        date = img.datetime.strftime("%Y-%m-%d")
-        time = img.datetime.strftime("%H:%M:%S")
+        for label in (self.label_filename, self.label_exposure, self.label_date, 
+                      self.label_time, self.label_beam):
+            label.grid(column=0, row=r, sticky=W); r+=1
         
-        ttk.Label(frame_column0, text=date).grid(column=0, row=r, sticky=W); r+=1
-        ttk.Label(frame_column0, text=time).grid(column=0, row=r, sticky=W); r+=1
+        self.set_labels()
         
         # Columnn 1 -----------------------------------------------------
         
@@ -226,11 +259,86 @@ class fits_tab(object):
         # resizing
         tab_frame.grid_columnconfigure(0, weight=1)        # main area
         tab_frame.grid_rowconfigure(9, weight=1)            # main area
+        
+        # wait for the image
+        if isinstance(img, fits):
+            self._set_image(img)
+        else:
+            self._wait_for_image(img)
+    
+    # ======================================================================= #
+    def _set_image(self, img):
+        """Use a loaded image, and do any drawing which was waiting for it"""
+        
+        img.plt = self.plt
+        self.img = img
+        self.header = img.header
+        self.last_used = time.monotonic()
+        
+        if self._on_load is not None:
+            fn, self._on_load = self._on_load, None
+            fn()
+        
+        self.bccd.update_memory()
+    
+    # ======================================================================= #
+    def _wait_for_record(self, future):
+        """Check if stored results were found, and check again later if not"""
+        
+        if not future.done():
+            self._find_job = self.tab_frame.after(self.load_interval, 
+                                                  self._wait_for_record, future)
+            return
+        
+        self._find_job = None
+        
+        try:
+            stored = future.result()
+        except Exception:
+            return
+        
+        if stored is not None:
+            self.set_labels(stored[1])
     
+    # ======================================================================= #
+    def _wait_for_image(self, future):
+        """Check if the image is loaded, and check again later if not"""
+        
+        notebook = self.bccd.notebook
+        text = 'Img %d' % (self.id+1)
+        
+        if not future.done():
+            notebook.tab(self.tab_frame, text=text+' (loading)')
+            self._load_job = self.tab_frame.after(self.load_interval, 
+                                                  self._wait_for_image, future)
+            return
+        
+        self._load_job = None
+        notebook.tab(self.tab_frame, text=text)
+        
+        try:
+            img = future.result()
+        except Exception as err:
+            self._on_load = None
+            self.label_beam['text'] = 'Failed to read image'
+            messagebox.showerror('Failed to read image', 
+                                 '%s\n\n%s' % (self.filename, err))
+            return
+        
+        self._set_image(img)
+        
     # ======================================================================= #
     def close(self):
         """Remove the tab"""
         
+        if self._load_job is not None:
+            self.tab_frame.after_cancel(self._load_job)
+            self._load_job = None
+        
+        if self._find_job is not None:
+            self.tab_frame.after_cancel(self._find_job)
+            self._find_job = None
+    
         selected = self.bccd.notebook.select()
         self.bccd.notebook.forget(selected)
         self.tab_frame.destroy()
@@ -244,6 +352,8 @@ class fits_tab(object):
             if tab is self:
                 del self.bccd.tabs[i]
                 break
+        
+        self.bccd.update_memory()
     
     # ======================================================================= #
     def change_draw_fn(self, event, frame, row):
@@ -252,16 +362,22 @@ class fits_tab(object):
         self.input_place(frame, row)
     
     # ======================================================================= #
-    def draw(self):
+    def draw(self, replace=None):
         """
-            Draw image based on selection
+            Draw image based on selection, or when loaded
+            
+            replace: filename of a drawn image to replace
         """
         
+        if self.img is None:
+            self._on_load = partial(self.draw, replace=replace)
+            return
+        
         # get draw style
         style = self.style.get()
         
         # get draw fn
-        fn = self.styles[style][0]
+        fn = getattr(self.img, self.styles[style][0])
         
         # set black level 
         self.img.set_black(float(self.black.get())*1e4)
@@ -278,38 +394,86 @@ class fits_tab(object):
             else:
                 options[k] = v[0].get()
         
-        # draw
-        fn(**options)
+        # lay out and redraw the figure once, at the end
+        with self.plt.transaction():
+            # replace the image in place if drawn as greyscale, else remove it
+            if replace is not None:
+                if style == 'Greyscale':
+                    options['replace'] = replace
+                else:
+                    self.plt._remove_drawn_object(self.plt.gca(), replace)
         
-        # remove title if exists
-        self.remove_title()
-    
-        # set title
-        if self.bccd.draw_title.get():
-            ax = self.plt.gca()
-            new_line = os.path.split(self.img.filename)[-1]
-            title = ax.get_title()
-            title = new_line + "\n" + title
-            title = title.strip()
-            ax.set_title(title, fontsize='x-small')
+            # draw
+            fn(**options)
         
-        self.plt.tight_layout()
+            # remove title if exists
+            self.remove_title()
+    
+            # set title
+            if self.bccd.draw_title.get():
+                ax = self.plt.gca()
+                new_line = os.path.split(self.img.filename)[-1]
+                title = ax.get_title()
+                title = new_line + "\n" + title
+                title = title.strip()
+                ax.set_title(title, fontsize='x-small')
+        
+            self.plt.tight_layout()
+        
+        # pixels are read again if they were freed, check the total
+        self.last_used = time.monotonic()
+        self.bccd.update_memory()
+        self.bccd.update_overlaps()
         
     # ======================================================================= #
     def draw_new(self):
         """
-            Draw in a new window
+            Draw in a new window, or when loaded
+        """
+        
+        if self.img is None:
+            self._on_load = self.draw_new
+            return
+        
+        # one redraw for the image and targets
+        with self.plt.transaction():
+            # draw
+            self.plt.figure()
+            self.draw()
+        
+            # draw targets
+            bccd = self.bccd
+            if bccd.draw_new_target.get():
+                for t in bccd.targets:
+                    t.draw()
+        
+    # ======================================================================= #
+    def get_beam(self):
+        """
+            Get the beam position and shape: the last gaussian2D fit of the 
+            image, else the analysis results shown
+            
+            returns: gaussian2D parameters (x0, y0, sigmax, sigmay, amp, theta),
+                     or None if not known
         """
         
-        # draw
-        self.plt.figure()
-        self.draw()
+        if self.img is not None and hasattr(self.img, 'result_gaussian2D'):
+            return self.img.result_gaussian2D['result'].values
         
-        # draw targets
-        bccd = self.bccd
-        if bccd.draw_new_target.get():
-            for t in bccd.targets:
-                t.draw()
+        if self.record is None:
+            return None
+        
+        for prefix in ('gaussian2D', 'moments'):
+            try:
+                par = [self.record['%s_%s' % (prefix, n)] for n in 
+                       ('x0', 'y0', 'sigmax', 'sigmay', 'amp', 'theta')]
+            except KeyError:
+                continue
+                
+            if not np.isnan(par[0]):
+                return par
+        
+        return None
         
     # ======================================================================= #
     def input_place(self, frame, row):
@@ -419,13 +583,19 @@ class fits_tab(object):
             
         self.input_objs = {}
         
+    # ======================================================================= #
+    def is_loading(self):
+        """True while the image is being read"""
+        return self._load_job is not None
+        
     # ======================================================================= #
     def remove(self):
         """
             Remove image from the active figure
         """
-        self.plt._remove_drawn_object(self.plt.gca(), self.filename)
-        self.remove_title()
+        with self.plt.transaction():
+            self.plt._remove_drawn_object(self.plt.gca(), self.filename)
+            self.remove_title()
         
     # ======================================================================= #
     def remove_title(self):
@@ -439,7 +609,7 @@ class fits_tab(object):
         title_list = title.split('\n')
         
         # remove title
-        rm_line = os.path.split(self.img.filename)[-1]
+        rm_line = os.path.split(self.filename)[-1]
         title = [t for t in title_list if t != rm_line]
         
         # reset title lines
@@ -451,7 +621,7 @@ class fits_tab(object):
         """
             Reset black to header value
         """
-        black = self.img.header['BZERO']/1e4
+        black = self.header['BZERO']/1e4
         self.entry_black.delete(0, END)
         self.entry_black.insert(0, str(black))
         self.black.set(str(black))
@@ -475,3 +645,101 @@ class fits_tab(object):
         imap = self.input_objs['imap'][0]
         cmap = self.input_objs['cmap'][0]
         imap.set(self.colours[cmap.get()])
+        
+    # ======================================================================= #
+    def set_labels(self, record=None):
+        """
+            Show the file details and beam position
+            
+            record: dict of analysis results (see analysis.analyze_image). If 
+                    None, show stored results, if any. Files which are new to 
+                    the results store are hashed in the background, and the 
+                    label is set when done. 
+        """
+        
+        header = self.header
+        
+        self.label_filename['text'] = os.path.basename(self.filename)
+        self.label_exposure['text'] = 'Exposure: %.3f s' % header['EXPOSURE']
+        
+        # date and time, converted from utc to local
+        date = get_datetime(header)
+        self.label_date['text'] = date.strftime("%Y-%m-%d")
+        self.label_time['text'] = date.strftime("%H:%M:%S")
+        
+        # stop waiting for the results of the last file
+        if self._find_job is not None:
+            self.tab_frame.after_cancel(self._find_job)
+            self._find_job = None
+        
+        # stored beam position, without fitting or hashing the file here
+        if record is None:
+            stored = self.bccd.results.find(self.filename, analysis.version, 
+                                            compute=False)
+            if stored is not None:
+                record = stored[1]
+            else:
+                self._wait_for_record(self.bccd.loader.find(self.filename, 
+                                                            analysis.version))
+        
+        text = ''
+        if record is not None:
+            no_beam = 'error' in record
+            for prefix, sx, sy in (('gaussian2D', 'sigmax', 'sigmay'), 
+                                   ('moments', 'sigmax', 'sigmay'), 
+                                   ('center', 'sigx', 'sigy')):
+                try:
+                    values = (record[prefix+'_x0'], record[prefix+'_y0'], 
+                              record[prefix+'_'+sx], record[prefix+'_'+sy])
+                except KeyError:
+                    continue
+                
+                if np.isnan(values[0]):
+                    no_beam = True
+                    continue
+                
+                text = 'Beam (%s): (%.1f, %.1f) px\nWidth: (%.1f, %.1f) px' % \
+                        (prefix, *values)
+                break
+            
+            # analyzed, but no result (ex: dark frame)
+            else:
+                if no_beam:
+                    text = 'No beam'
+        
+        self.label_beam['text'] = text
+        self.record = record
+        self.bccd.update_overlaps()
+        
+    # ======================================================================= #
+    def update_image(self, img, record=None):
+        """
+            Show the next image from the camera in this tab. If the last image 
+            is drawn in the active figure, it is replaced.
+            
+            img:    fits object
+            record: dict of analysis results for the beam position label
+        """
+        
+        old = self.filename
+        
+        # stop waiting for the image which was loading
+        if self._load_job is not None:
+            self.tab_frame.after_cancel(self._load_job)
+            self._load_job = None
+        
+        # is the last image drawn?
+        drawn = self.img is not None and bool(self.plt.plots) and \
+                old in self.plt.gca().draw_objs
+        
+        # one redraw for the title and image
+        with self.plt.transaction():
+            if drawn:
+                self.remove_title()
+            
+            self._set_image(img)
+            self.filename = img.filename
+            self.set_labels(record)
+            
+            if drawn:
+                self.draw(replace=old)